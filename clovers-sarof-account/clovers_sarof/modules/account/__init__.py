@@ -1,4 +1,5 @@
 import random
+import asyncio
 from datetime import datetime
 from PIL import ImageColor
 from linecard import ImageList
@@ -6,9 +7,9 @@ from clovers import TempHandle
 from clovers.config import Config as CloversConfig
 from clovers_apscheduler import scheduler
 from clovers_sarof.core import __plugin__ as plugin, Event, Rule
-from clovers_sarof.core import manager, client
+from clovers_sarof.core import manager, client, avatars
 from clovers_sarof.core import GOLD, STD_GOLD, REVOLUTION_MARKING, DEBUG_MARKING
-from clovers_sarof.core.account import Stock, Account, Group, AccountBank, UserBank
+from clovers_sarof.core.account import Session, Stock, Account, Group, AccountBank
 from clovers_sarof.core.linecard import (
     text_to_image,
     card_template,
@@ -16,10 +17,11 @@ from clovers_sarof.core.linecard import (
     item_info,
     item_card,
     stock_card,
-    candlestick,
+    candlestick_cache,
     dist_card,
 )
 from clovers_sarof.core.tools import download_url, format_number
+from clovers_sarof.core.render import submit
 from .config import Config
 
 config_data = CloversConfig.environ().setdefault(__package__, {})
@@ -38,8 +40,8 @@ async def _(event: Event):
     user_id = event.user_id
     log = []
     if args := event.args:
-        BG_type = args[0]
-        with manager.db.session as session:
+
+        def set_BG_type(session: Session, BG_type: str):
             user = manager.db.user(user_id, session)
             if BG_type.startswith("高斯模糊"):
                 try:
@@ -58,13 +60,16 @@ async def _(event: Event):
                     user.extra["BG_type"] = BG_type
                 except ValueError:
                     BG_type = "ValueError"
-            session.commit()
-            log.append(f"背景蒙版类型设置为：{BG_type}")
+            return BG_type
+
+        BG_type = await manager.db.run(set_BG_type, args[0])
+        log.append(f"背景蒙版类型设置为：{BG_type}")
     if url_list := event.image_list:
         if (image := await download_url(url_list[0], client)) is None:
             log.append("图片下载失败")
         else:
             manager.BG_PATH.joinpath(f"{user_id}.png").write_bytes(image)
+            manager.background.discard(user_id)
             log.append("图片下载成功")
     if log:
         return "\n".join(log)
@@ -73,12 +78,13 @@ async def _(event: Event):
 @plugin.handle(["删除背景"], ["user_id", "to_me"], rule=Rule.to_me)
 async def _(event: Event):
     manager.BG_PATH.joinpath(f"{event.user_id}.png").unlink(True)
+    manager.background.discard(event.user_id)
     return "背景图片删除成功！"
 
 
 @plugin.handle(["金币签到", "轮盘签到"], ["user_id", "group_id", "nickname", "avatar"])
 async def _(event: Event):
-    with manager.db.session as session:
+    def sign_in(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
@@ -90,8 +96,9 @@ async def _(event: Event):
         n = random.randint(*sign_gold)
         account.sign_in = today
         GOLD.deal(account, n, session)
-        session.commit()
-    return random.choice(["祝你好运~", "可别花光了哦~"]) + f"\n你获得了 {n} {GOLD.name}"
+        return random.choice(["祝你好运~", "可别花光了哦~"]) + f"\n你获得了 {n} {GOLD.name}"
+
+    return await manager.db.run(sign_in)
 
 
 @plugin.handle(["发红包"], ["user_id", "group_id", "at", "permission"], rule=[Rule.at, Rule.group])
@@ -105,8 +112,8 @@ async def _(event: Event):
             return "你输入了负数，请不要这样做。"
         sender_id, receiver_id = receiver_id, sender_id
         unsettled = -unsettled
-    with manager.db.session as session:
-        return manager.transfer(GOLD, unsettled, sender_id, receiver_id, group_id, session)[1]
+    transfer = lambda session: manager.transfer(GOLD, unsettled, sender_id, receiver_id, group_id, session)[1]
+    return await manager.db.run(transfer)
 
 
 @plugin.handle(["送道具"], ["user_id", "group_id", "at", "permission"], rule=[Rule.at, Rule.group])
@@ -125,8 +132,8 @@ async def _(event: Event):
             return "你输入了负数，请不要这样做。"
         sender_id, receiver_id = receiver_id, sender_id
         unsettled = -unsettled
-    with manager.db.session as session:
-        return manager.transfer(item, unsettled, sender_id, receiver_id, group_id, session)[1]
+    transfer = lambda session: manager.transfer(item, unsettled, sender_id, receiver_id, group_id, session)[1]
+    return await manager.db.run(transfer)
 
 
 @plugin.handle(r"(.+)查询$", ["user_id", "group_id", "nickname"])
@@ -134,16 +141,19 @@ async def _(event: Event):
     item = manager.items_library.get(event.args[0])
     if not item:
         return
-    with manager.db.session as session:
+
+    def query(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
         return f"你还有 {item.bank(account, session).n} 个{item.name}"
 
+    return await manager.db.run(query)
+
 
 @plugin.handle(["我的信息", "我的资料卡"], ["user_id", "group_id", "nickname"])
 async def _(event: Event):
-    with manager.db.session as session:
+    def info(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
@@ -184,26 +194,40 @@ async def _(event: Event):
         if user.mailbox:
             message_lines.extend(user.mailbox)
             user.mailbox = []
-            session.commit()
-    imagelist: ImageList = []
-    imagelist.append(avatar_card(await download_url(avatar_url, client), nickname, marking_lines))
-    imagelist.append(text_to_image("\n".join(dist_lines), 40, canvas=dist_card(dist) if dist else None))
-    if stock_card_info is not None:
-        imagelist.append(card_template(stock_card_info, "股票信息"))
-    imagelist.append(card_template("\n".join(message_lines), "Message", font_size=30, autowrap=True))
-    return manager.info_card(imagelist, event.user_id)
+        return avatar_url, nickname, marking_lines, dist, dist_lines, stock_card_info, message_lines
+
+    result = await manager.db.run(info)
+    if isinstance(result, str):
+        return result
+    avatar_url, nickname, marking_lines, dist, dist_lines, stock_card_info, message_lines = result
+    avatar = await avatars.get(avatar_url)
+
+    def draw():
+        imagelist: ImageList = []
+        imagelist.append(avatar_card(avatar, nickname, marking_lines))
+        imagelist.append(text_to_image("\n".join(dist_lines), 40, canvas=dist_card(dist) if dist else None))
+        if stock_card_info is not None:
+            imagelist.append(card_template(stock_card_info, "股票信息"))
+        imagelist.append(card_template("\n".join(message_lines), "Message", font_size=30, autowrap=True))
+        return manager.draw_info_card(imagelist, event.user_id)
+
+    return submit(draw)
 
 
 @plugin.handle(["我的道具"], ["user_id", "group_id", "nickname"])
 async def _(event: Event):
-    with manager.db.session as session:
+    def query(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
         bank = account.bank + account.user.bank
         if not bank:
             return "您的仓库空空如也。"
-        item_data = manager.item_data(bank)
+        return manager.item_data(bank)
+
+    item_data = await manager.db.run(query)
+    if isinstance(item_data, str):
+        return item_data
     if len(item_data) < 10 or event.single_arg() in ("信息", "介绍", "详情"):
         imagelist = item_info(item_data)
     else:
@@ -213,11 +237,15 @@ async def _(event: Event):
 
 @plugin.handle(["股票查询", "投资查询"], ["user_id", "group_id", "nickname"])
 async def _(event: Event):
-    with manager.db.session as session:
+    def query(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
-        stock_data = manager.stock_data(account.user.bank, session)
+        return manager.stock_data(account.user.bank, session)
+
+    stock_data = await manager.db.run(query)
+    if isinstance(stock_data, str):
+        return stock_data
     if stock_data:
         return manager.info_card([card_template(stock_card(stock_data), f"股票信息:{event.nickname}")], event.user_id)
     else:
@@ -229,8 +257,8 @@ async def _(event: Event):
     """
     群资料卡
     """
-    group_name = event.single_arg()
-    with manager.db.session as session:
+
+    def query(session: Session, group_name: str | None):
         if group_name:
             if (stock := Stock.find(group_name, session)) is not None:
                 group = stock.group
@@ -244,7 +272,6 @@ async def _(event: Event):
         if (avatar_url := event.group_avatar) is not None:
             group.avatar_url = avatar_url
             session.add(group)
-            session.commit()
         else:
             avatar_url = group.avatar_url
         group_name = group.nickname
@@ -263,20 +290,38 @@ async def _(event: Event):
             )
         ).all()
         revolution_ranklist = "\n".join(f"{bank.account.nickname}[right]{bank.n}次" for bank in banks) if banks else None
-        candlestick_record = record if (stock := group.stock) and (record := stock.extra.get("record")) else None
+        if (stock := group.stock) is not None:
+            stock_id = stock.id
+            history = None if candlestick_cache.loaded(stock_id) else stock.history(session)
+        else:
+            stock_id = history = None
         item_data, stock_data = manager.bank_data(group.bank, session)
-
-    imagelist: ImageList = []
-    imagelist.append(avatar_card(await download_url(avatar_url, client) if avatar_url else None, group_name, lines))
-    if revolution_ranklist is not None:
-        imagelist.append(card_template(revolution_ranklist, "路灯挂件榜"))
-    if candlestick_record is not None:
-        imagelist.append(candlestick((9.5, 3), 12, candlestick_record))
-    if item_data:
-        imagelist.append(card_template(item_card(item_data), "群仓库"))
-    if stock_data:
-        imagelist.append(card_template(stock_card(stock_data), "群投资"))
-    return manager.info_card(imagelist, event.user_id)
+        stock_card_info = stock_card(stock_data) if stock_data else None
+        return avatar_url, group_name, lines, revolution_ranklist, stock_id, history, item_data, stock_card_info
+
+    result = await manager.db.run(query, event.single_arg())
+    if isinstance(result, str):
+        return result
+    avatar_url, group_name, lines, revolution_ranklist, stock_id, history, item_data, stock_card_info = result
+    avatar = await avatars.get(avatar_url)
+
+    def draw():
+        imagelist: ImageList = []
+        imagelist.append(avatar_card(avatar, group_name, lines))
+        if revolution_ranklist is not None:
+            imagelist.append(card_template(revolution_ranklist, "路灯挂件榜"))
+        if stock_id is not None:
+            if history is not None:
+                candlestick_cache.load_if_missing(stock_id, history)
+            if (chart := candlestick_cache.chart(stock_id, (9.5, 3))) is not None:
+                imagelist.append(chart)
+        if item_data:
+            imagelist.append(card_template(item_card(item_data), "群仓库"))
+        if stock_card_info is not None:
+            imagelist.append(card_template(stock_card_info, "群投资"))
+        return manager.draw_info_card(imagelist, event.user_id)
+
+    return submit(draw)
 
 
 # 超管指令
@@ -288,23 +333,29 @@ async def _(event: Event):
     item = manager.items_library.get(name)
     if not item:
         return f"没有【{name}】这种道具。"
-    with manager.db.session as session:
+
+    def obtain(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
         if (n := item.deal(account, N, session)) is None:
-            session.commit()
             return f"你获得了{N}个【{item.name}】！"
         return f"获取失败，你的【{item.name}】（{n}）数量不足。"
 
+    return await manager.db.run(obtain)
+
 
 async def cancel_confirm(event: Event, handle: TempHandle):
     handle.finish()
-    with manager.db.session as session:
+
+    def cancel(session: Session):
         account = session.get(Account, handle.state)
         assert account is not None
         nickname = account.nickname
         account.cancel(session)
+        return nickname
+
+    nickname = await manager.db.run(cancel)
     return f"冻结完成,目标账户【{nickname}】已注销。"
 
 
@@ -313,35 +364,49 @@ async def _(event: Event):
     if (group_id := event.group_id) is None:
         return
     user_id = event.user_id
-    with manager.db.session as session:
+
+    def query(session: Session):
         account = session.exec(Account.select().where(Account.user_id == user_id, Account.group_id == group_id)).one_or_none()
         if account is None:
-            return "目标账户不存在。"
-        t_account_id = account.id
-        t_nickname = account.nickname
-        t_user_id = account.user_id
+            return
+        return account.id, account.nickname, account.user_id
+
+    if (target := await manager.db.run(query)) is None:
+        return "目标账户不存在。"
+    t_account_id, t_nickname, t_user_id = target
     confirm_code = "".join(str(random.randint(0, 9)) for _ in range(4))
     confirm_rule: list[Rule.Checker] = [Rule.identify(user_id, group_id), lambda event: event.message == confirm_code]
     plugin.temp_handle(["user_id", "group_id", "permission"], rule=confirm_rule, state=t_account_id)(cancel_confirm)
     return f"您即将注销 {t_nickname}({t_user_id})，请输入{confirm_code}来确认。"
 
 
+async def restore_confirm(event: Event, handle: TempHandle):
+    handle.finish()
+    file = handle.state
+    # 在数据库线程中回档，避免与其他会话同时读写
+    await asyncio.get_running_loop().run_in_executor(manager.db.executor, manager.restore, file)
+    return f"回档完成，已恢复到备份 {file.name}"
+
+
+@plugin.handle(["数据回档"], ["user_id", "group_id", "permission"], rule=Rule.superuser)
+async def _(event: Event):
+    backups = manager.backups()
+    if not backups:
+        return "没有可用的备份。"
+    args = event.args
+    if len(args) < 2 or (file := backups.get(args[0], {}).get(args[1])) is None:
+        info = [f"{date}\n{" ".join(files)}" for date, files in backups.items()]
+        return "请输入【数据回档 日期 时间】选择备份：\n" + "\n".join(info)
+    confirm_code = "".join(str(random.randint(0, 9)) for _ in range(4))
+    user_id = event.user_id
+    confirm_rule: Rule.Checker = lambda event: event.user_id == user_id and event.message == confirm_code
+    plugin.temp_handle(["user_id", "group_id", "permission"], rule=confirm_rule, state=file)(restore_confirm)
+    return f"您即将回档到 {args[0]} {args[1]}，当前数据会先备份，请输入{confirm_code}来确认。"
+
+
 def new_day():
     manager.clean_backup(604800)
-    with manager.db.session as session:
-        banks: list[UserBank | AccountBank] = []
-        banks.extend(session.exec(UserBank.select().where(UserBank.item_id.startswith("item:"))).all())
-        banks.extend(session.exec(AccountBank.select().where(AccountBank.item_id.startswith("item:"))).all())
-        for bank in banks:
-            if (item := manager.items_library.get(bank.item_id)) is None:
-                session.delete(item)
-                continue
-            if item.timeliness == 0:
-                bank.n -= 1
-                if bank.n <= 0:
-                    session.delete(item)
-                    continue
-        session.commit()
+    manager.expire_items()
 
 
 scheduler.add_job(new_day, trigger="cron", hour=0, misfire_grace_time=120)
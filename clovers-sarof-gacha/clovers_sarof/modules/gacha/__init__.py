@@ -10,7 +10,7 @@ from clovers_sarof.core import GOLD, STD_GOLD
 from clovers_sarof.core.account import Session, Item, Stock, Account, AccountBank, UserBank
 from clovers_sarof.core.linecard import card_template, item_card
 from clovers_sarof.core.tools import format_number
-from .core import pool, usage, AIR_PACK, RED_PACKET, VIP_CARD
+from .core import pool, usage, temp_handle, AIR_PACK, RED_PACKET, VIP_CARD
 from .image import report_card
 from .config import Config
 
@@ -20,6 +20,7 @@ __config__ = Config.model_validate(config_data)
 config_data.update(__config__.model_dump())
 
 gacha_gold = __config__.gacha_gold
+gacha_limit = __config__.gacha_limit
 packet_gold = __config__.packet_gold
 luckey_coin_limit = __config__.luckey_coin_limit
 ticket_price = gacha_gold * 50
@@ -34,9 +35,10 @@ async def _(event: Event):
     count = event.args_to_int()
     if not count:
         return
-    count = 200 if count > 200 else 1 if count < 1 else count
+    count = gacha_limit if count > gacha_limit else 1 if count < 1 else count
     cost_gold = count * gacha_gold
-    with manager.db.session as session:
+
+    def gacha(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
@@ -44,7 +46,7 @@ async def _(event: Event):
             return f"{count}连抽卡需要{cost_gold}金币，你的金币：{tn}。"
         prop_data: list[list[tuple[Item, int]]] = [[], [], []]
         report_data = {"prop_star": 0, "prop_n": 0, "air_star": 0, "air_n": 0}
-        for prop, n in Counter(pool.gacha() for _ in range(count)).items():
+        for prop, n in pool.gacha_many(count).items():
             prop_data[prop.domain].append((prop, n))
             if prop.domain == 0:
                 star_key = "air_star"
@@ -52,26 +54,31 @@ async def _(event: Event):
             else:
                 star_key = "prop_star"
                 n_key = "prop_n"
-                prop.deal(account, n, session)
             report_data[star_key] += prop.rare * n
             report_data[n_key] += n
-        if count < 10:
-            return "你获得了" + "\n".join(f"({prop.rare}☆){prop.name}:{n}个" for seg in prop_data for prop, n in seg)
+        if count >= 10 and report_data["prop_n"] == 0:
+            Item.grant(account, [(AIR_PACK, 1), (RED_PACKET, 10), (GOLD, cost_gold)], session)
         else:
-            info = [report_card(account.nickname, **report_data)]
-            if report_data["prop_n"] == 0:
-                AIR_PACK.deal(account, 1, session)
-                RED_PACKET.deal(account, 10, session)
-                GOLD.deal(account, cost_gold, session)
-                info.append(card_template(item_card([(AIR_PACK, 1), (GOLD, cost_gold), (RED_PACKET, 10)]), f"本次抽卡已免费"))
-            air_prop, local_prop, global_prop = prop_data
-            if global_prop:
-                info.append(card_template(item_card(global_prop), f"全局道具"))
-            if local_prop:
-                info.append(card_template(item_card(local_prop), f"群内道具"))
-            if air_prop:
-                info.append(card_template(item_card(air_prop), f"未获取"))
-        return manager.info_card(info, event.user_id)
+            Item.grant(account, prop_data[1] + prop_data[2], session)
+        return account.nickname, prop_data, report_data
+
+    result = await manager.db.run(gacha)
+    if isinstance(result, str):
+        return result
+    nickname, prop_data, report_data = result
+    if count < 10:
+        return "你获得了" + "\n".join(f"({prop.rare}☆){prop.name}:{n}个" for seg in prop_data for prop, n in seg)
+    info = [report_card(nickname, **report_data)]
+    if report_data["prop_n"] == 0:
+        info.append(card_template(item_card([(AIR_PACK, 1), (GOLD, cost_gold), (RED_PACKET, 10)]), f"本次抽卡已免费"))
+    air_prop, local_prop, global_prop = prop_data
+    if global_prop:
+        info.append(card_template(item_card(global_prop), f"全局道具"))
+    if local_prop:
+        info.append(card_template(item_card(local_prop), f"群内道具"))
+    if air_prop:
+        info.append(card_template(item_card(air_prop), f"未获取"))
+    return manager.info_card(info, event.user_id)
 
 
 @usage("金币")
@@ -110,13 +117,16 @@ def _(account: Account, session: Session, item: Item, count: int, extra: str):
 
 async def recv_red_packet(event: Event, handle: TempHandle):
     handle.finish()
-    with manager.db.session as session:
+
+    def receive(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "领取失败...未找到你的账户。"
         RED_PACKET.deal(account, 1, session)
         return f"领取成功，你已获得1个{RED_PACKET.name}"
 
+    return await manager.db.run(receive)
+
 
 @usage("幸运硬币", 1)
 def _(account: Account, session: Session, item: Item, count: int, extra: str):
@@ -151,7 +161,7 @@ def _(account: Account, session: Session, item: Item, count: int, extra: str):
                 user_id = account.user_id
                 group_id = account.group_id
                 rule: list[Rule.Checker] = [Rule.identify(user_id, group_id), lambda event: event.message == "领取红包"]
-                plugin.temp_handle(["user_id", "group_id", "nickname"], rule=rule)(recv_red_packet)
+                temp_handle(session, ["user_id", "group_id", "nickname"], rule=rule)(recv_red_packet)
     session.commit()
     return "\n".join(info)
 
@@ -224,7 +234,7 @@ def _(account: Account, session: Session, item: Item, count: int, extra: str):
     user_id = account.user_id
     group_id = account.group_id
     rule: list[Rule.Checker] = [Rule.identify(user_id, group_id), lambda event: event.message in ("开枪", "取消")]
-    plugin.temp_handle(["user_id", "group_id"], rule=rule, state=(account.id, item.id))(devil_shoot)
+    temp_handle(session, ["user_id", "group_id"], rule=rule, state=(account.id, item.id))(devil_shoot)
     return "你手中的左轮枪已经装好了子弹，请开枪，或者取消。"
 
 
@@ -240,12 +250,11 @@ async def devil_shoot(event: Event, handle: TempHandle):
             bullet_lst[i] = 1
         if bullet_lst[0] == 1:
             yield "砰！一团火从枪口喷出，你从这个世界上消失了。"
-            with manager.db.session as session:
-                user = manager.db.user(event.user_id, session)
-                user.cancel(session)
+            await manager.db.run(lambda session: manager.db.user(event.user_id, session).cancel(session))
         else:
             yield "咔！你活了下来..."
-            with manager.db.session as session:
+
+            def reward(session: Session):
                 counter = Counter[str]()
                 for bank in session.exec(UserBank.select().where(UserBank.bound_id == event.user_id)):
                     item_id = bank.item_id
@@ -281,7 +290,10 @@ async def devil_shoot(event: Event, handle: TempHandle):
                         continue
                     item.deal(account, n, session)
                     data.append((item, n))
-                session.commit()
+                return data
+
+            if (data := await manager.db.run(reward)) is None:
+                return
             data.sort(key=lambda x: x[0].rare)
             yield ["这是你获得的道具", manager.info_card([card_template(item_card(data), "10倍奖励")], event.user_id)]
             await asyncio.sleep(0.5)
@@ -309,7 +321,8 @@ def _(account: Account, session: Session, item: Item, count: int, extra: str):
     session.add(key_bank)
     session.commit()
     rule: Rule.Checker = lambda e: e.user_id == account.user_id
-    plugin.temp_handle(
+    temp_handle(
+        session,
         ["user_id", "group_id", "nickname"],
         timeout=180,
         rule=rule,
@@ -327,10 +340,13 @@ async def unlock_case(event: Event, handle: TempHandle):
     code: str
     log: list[str]
     account_id, code, log = handle.state  # type: ignore
-    with manager.db.session as session:
+
+    def check(session: Session):
         account = manager.account(event, session)
-        if account is None or account.id != account_id:
-            return
+        return account is not None and account.id == account_id
+
+    if not await manager.db.run(check):
+        return
     if event.message == "取消":
         handle.finish()
         return "取消解锁！"
@@ -372,10 +388,13 @@ async def unlock_case(event: Event, handle: TempHandle):
             item = manager.items_library["初级元素"]
             n = random.randint(5, 10) * times
             tip = "神秘的箱子被打开，里面散发出彩色的微光..."
-        with manager.db.session as session:
+
+        def reward(session: Session):
             account = manager.account(event, session)
             assert account is not None
             item.deal(account, n, session)
+
+        await manager.db.run(reward)
         handle.finish()
         return f"密码为:{inputs_code} 输入正确！\n{tip}\n你获得了{n}个{item.name}。"
     else:
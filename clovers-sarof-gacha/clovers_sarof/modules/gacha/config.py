@@ -4,6 +4,8 @@ from pydantic import BaseModel
 class Config(BaseModel):
     # 抽卡所需金币
     gacha_gold: int = 50
+    # 单次抽卡数量上限
+    gacha_limit: int = 200
     # 礼包金币范围
     packet_gold: tuple[int, int] = (200, 2000)
     # 幸运硬币赌注范围
@@ -1,11 +1,14 @@
 import json
-import random
+import numpy as np
 from pathlib import Path
 from typing import Any
-from collections.abc import Callable, Iterable
+from collections import Counter
+from collections.abc import Callable, Coroutine, Iterable
+from clovers import TempHandle
 from clovers_sarof.core import __plugin__ as plugin, Event
 from clovers_sarof.core import manager
 from clovers_sarof.core.account import Item, Account, Session
+from clovers_sarof.core.tools import AliasSampler
 
 
 for k, v in json.loads(Path(__file__).parent.joinpath("props_library.json").read_text(encoding="utf_8")).items():
@@ -20,25 +23,90 @@ VIP_CARD = manager.items_library["钻石会员卡"]
 
 
 class CardPool:
-    def __init__(self):
+    def __init__(self, seed: int | None = None):
         self.pool: dict[int, list[Item]] = {}
         self.prob = (0.3, 0.1, 0.1, 0.02)
         self.min_rare = 3
+        self.rng = np.random.default_rng(seed)
+        """gacha_many 使用的随机数生成器"""
+        self.version = 0
+        """道具池版本，道具池变化时递增"""
+        self._sampler: AliasSampler[Item] | None = None
+        self._star_pmf: np.ndarray | None = None
+
+    def _changed(self):
+        self.version += 1
+        self._sampler = None
+        self._star_pmf = None
+
+    @property
+    def sampler(self):
+        """全部道具的别名抽样表，道具池变化后重新构建"""
+        if self._sampler is None:
+            items: list[Item] = []
+            weights: list[float] = []
+            for rare, prob in enumerate(self.prob, start=self.min_rare):
+                if pool := self.pool.get(rare):
+                    items.extend(pool)
+                    weights.extend([prob / len(pool)] * len(pool))
+            items.append(AIR)
+            weights.append(max(0.0, 1.0 - sum(weights)))
+            self._sampler = AliasSampler(items, weights)
+        return self._sampler
 
     def gacha(self):
         """随机获取道具"""
-        rand = random.uniform(0.0, 1.0)
-        rare = self.min_rare
-        for prob in self.prob:
-            rand -= prob
-            if rand <= 0:
-                break
-            rare += 1
-        return random.choice(pool) if (pool := self.pool.get(rare)) else AIR
+        return self.sampler.sample()
+
+    @property
+    def star_pmf(self):
+        """单抽获得道具☆数的概率分布，下标为☆数，空气计为 0☆"""
+        if self._star_pmf is None:
+            pmf = np.zeros(self.min_rare + len(self.prob))
+            for rare, prob in enumerate(self.prob, start=self.min_rare):
+                if pool := self.pool.get(rare):
+                    pmf[rare] = prob * sum(item.domain != 0 for item in pool) / len(pool)
+            pmf[0] = max(0.0, 1.0 - pmf.sum())
+            self._star_pmf = pmf
+        return self._star_pmf
+
+    def star_percentiles(self, n: int, percentiles: Iterable[float]) -> list[float]:
+        """
+        n 连抽平均每抽获得道具☆数的百分位数
+            n 次抽卡☆数之和的分布是单抽分布的 n 重卷积，在频域中为 n 次幂
+            percentiles: 百分位，0 ~ 100
+        """
+        pmf = self.star_pmf
+        size = (len(pmf) - 1) * n + 1
+        cdf = np.cumsum(np.clip(np.fft.irfft(np.fft.rfft(pmf, size) ** n, size), 0.0, None))
+        cdf /= cdf[-1]
+        return [int(np.searchsorted(cdf, percentile / 100 - 1e-9)) / n for percentile in percentiles]
+
+    def gacha_many(self, n: int, rng: np.random.Generator | None = None) -> Counter[Item]:
+        """
+        批量抽取道具，与调用 n 次 gacha 同分布
+            先按稀有度概率做一次多项分布抽样，再在每个稀有度的道具中均匀抽样
+            rng: 指定随机数生成器，默认使用 self.rng
+            return: {道具: 数量}
+        """
+        rng = self.rng if rng is None else rng
+        rare_prob = [*self.prob, max(0.0, 1.0 - sum(self.prob))]
+        result: Counter[Item] = Counter()
+        for rare, k in enumerate(rng.multinomial(n, rare_prob).tolist(), start=self.min_rare):
+            if k == 0:
+                continue
+            if not (pool := self.pool.get(rare)):
+                result[AIR] += k
+                continue
+            for item, m in zip(pool, rng.multinomial(k, [1 / len(pool)] * len(pool)).tolist()):
+                if m > 0:
+                    result[item] += m
+        return result
 
     def append(self, item: Item):
         """添加道具"""
         self.pool.setdefault(item.rare, []).append(item)
+        self._changed()
 
     def extend(self, items: Iterable[Item]):
         """添加道具池"""
@@ -47,6 +115,7 @@ class CardPool:
 
     def remove(self, item: Item):
         """弹出道具"""
+        self._changed()
         return self.pool[item.rare].remove(item)
 
 
@@ -84,17 +153,41 @@ async def _(event: Event):
     if count < 1:
         return "请输入正确的数量。"
     use, cost = use
-    with manager.db.session as session:
+
+    def use_item(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
         item = manager.items_library[item_name]
-        if cost != 0:
-            cost = cost or count
-            if (tn := item.deal(account, -cost, session)) is not None:
+        n = count if cost is None else cost
+        if n != 0:
+            if (tn := item.deal(account, -n, session)) is not None:
                 return f"使用失败，你还有{tn}个{item.name}。"
         return use(account, session, item, count, extra)
 
+    def transaction(session: Session):
+        return use_item(session), session.info.pop("temp_handles", [])
+
+    result, temp_handles = await manager.db.run(transaction)
+    # 提交成功后回到事件循环注册临时响应
+    for func, properties, kwargs in temp_handles:
+        plugin.temp_handle(properties, **kwargs)(func)
+    return result
+
+
+def temp_handle(session: Session, properties: Iterable[str], **kwargs):
+    """
+    注册道具使用后的临时响应
+        使用方法在数据库线程中执行，临时响应先暂存在会话里，提交后由事件循环注册
+        kwargs: 同 plugin.temp_handle
+    """
+
+    def decorator(func: Callable[[Event, TempHandle], Coroutine]):
+        session.info.setdefault("temp_handles", []).append((func, properties, kwargs))
+        return func
+
+    return decorator
+
 
 def usage(item_name: str, cost: int | None = None):
     def decorator(use: ItemUsage):
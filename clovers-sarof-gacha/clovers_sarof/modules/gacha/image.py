@@ -1,14 +1,20 @@
-import numpy as np
 from clovers_sarof.core.linecard import card_template
+from clovers_sarof.core.tools import LRUCache
+from .core import pool
 
-fitfunc_dict = {
-    1: lambda x: 0.4051548792879075 * np.log(1.5220797359057374 * x) + -0.0020201103448929322 * x + -1.0258025707645715,
-    2: lambda x: 0.2091504808791389 * np.log(1.101707968990964e-14 * x) + -0.0009065271163526587 * x + 6.81737635995572,
-    3: lambda x: 0.13706213955909696 * np.log(739.4329972067283 * x) + -0.0007205797484775894 * x + -0.395220181962607,
-    4: lambda x: -0.10977545924670605 * np.log(5.0664130329281946e-15 * x) + 0.0004868571908065122 * x + -1.8622074263416735,
-    5: lambda x: -0.24869846144440189 * np.log(297.60014651115324 * x) + 0.0012632334635791975 * x + 3.8330390561576926,
-    6: lambda x: -0.5086236385670387 * np.log(3.240687588979718e-13 * x) + 0.002785268129815752 * x + -10.987495694881874,
-}
+PERCENTILES = (1, 10, 25, 75, 90, 99)
+"""报告称号的分档百分位"""
+thresholds_cache = LRUCache[tuple[int, int], list[float]](1024)
+"""(道具池版本, 抽卡次数) -> 分档阈值"""
+
+
+def report_thresholds(n: int):
+    """n 连抽的分档阈值，按道具池版本缓存"""
+    key = (pool.version, n)
+    if (thresholds := thresholds_cache.get(key)) is None:
+        thresholds = pool.star_percentiles(n, PERCENTILES)
+        thresholds_cache.set(key, thresholds)
+    return thresholds
 
 
 def report_card(
@@ -20,21 +26,22 @@ def report_card(
 ):
     N = prop_n + air_n
     pt = prop_star / N
+    p1, p10, p25, p75, p90, p99 = report_thresholds(N)
     title = []
 
     if not prop_n:
         title.append("[center][font color=#003300]理 想 气 体")
-    elif pt < fitfunc_dict[1](N):
+    elif pt < p1:
         title.append("[center][font color=#003300]极致闪避")
-    elif pt < fitfunc_dict[2](N):
+    elif pt < p10:
         title.append("[left][font color=#003333]☆[center]数据异常[right]☆")
-    elif pt < fitfunc_dict[3](N):
+    elif pt < p25:
         title.append("[left][font color=#003366]☆ ☆[center]下位分析[right]☆ ☆")
-    elif pt < fitfunc_dict[4](N):
+    elif pt < p75:
         title.append("[left][font color=#003399]☆ ☆ ☆[center]高斯分布[right]☆ ☆ ☆")
-    elif pt < fitfunc_dict[5](N):
+    elif pt < p90:
         title.append("[left][font color=#0033CC]☆ ☆ ☆ ☆[center]对称破缺[right]☆ ☆ ☆ ☆")
-    elif pt < fitfunc_dict[6](N):
+    elif pt < p99:
         title.append("[left][font color=#0033FF]☆ ☆ ☆ ☆ ☆[center]概率之子[right]☆ ☆ ☆ ☆ ☆")
     else:
         title.append("[center][font color=#FF0000]☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆☆")
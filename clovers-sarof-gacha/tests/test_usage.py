@@ -0,0 +1,75 @@
+import os
+import sys
+import asyncio
+import tempfile
+from pathlib import Path
+
+import matplotlib
+import pytest
+
+workdir = Path(tempfile.mkdtemp())
+font = Path(matplotlib.get_data_path()) / "fonts" / "ttf" / "DejaVuSans.ttf"
+workdir.joinpath("clovers.toml").write_text(
+    f'["clovers_sarof.core"]\npath = "{(workdir / "data").as_posix()}"\nfontname = "{font.as_posix()}"\nfallback_fonts = []\n',
+    encoding="utf-8",
+)
+os.environ["CLOVERS_CONFIG_FILE"] = str(workdir / "clovers.toml")
+# 合并后的插件包，由 tools/build_test.py 生成
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "test-package"))
+
+from clovers.core import Event as BaseEvent
+from clovers_sarof.core import __plugin__ as plugin, manager, GOLD
+from clovers_sarof.core.account import Item
+from clovers_sarof.modules.gacha.core import usage_lib
+
+plugin.set_temp_handles(temp_handles := [])
+properties = {"user_id": "u1", "group_id": "g1", "nickname": "nick", "to_me": True, "permission": 0, "at": [], "image_list": []}
+
+
+async def send(message: str):
+    for handle in sorted(plugin.handles, key=lambda handle: handle.priority):
+        if (args := handle.match(message)) is None:
+            continue
+        if (result := await handle.func(BaseEvent(message, args, properties, {}, {}))) is not None:
+            return result
+
+
+def gold():
+    with manager.db.session as session:
+        return GOLD.bank(manager.db.account("u1", "g1", session), session).n
+
+
+@pytest.fixture(autouse=True)
+def account():
+    with manager.db.session as session:
+        bank = GOLD.bank(manager.db.account("u1", "g1", session), session)
+        bank.n = 10
+        session.add(bank)
+
+
+def give(item_name: str, n: int):
+    item: Item = manager.items_library[item_name]
+    with manager.db.session as session:
+        item.deal(manager.db.account("u1", "g1", session), n, session)
+
+
+def test_usage_cost():
+    assert "金币" in usage_lib
+    result = asyncio.run(send("使用 金币 3"))
+    assert result is not None and result.data == "你使用了3枚金币。"
+    assert gold() == 7
+
+
+def test_usage_cost_not_enough():
+    result = asyncio.run(send("使用道具 金币 11"))
+    assert result is not None and result.data == "使用失败，你还有10个金币。"
+    assert gold() == 10
+
+
+def test_usage_temp_handle():
+    temp_handles.clear()
+    give("恶魔轮盘", 1)
+    result = asyncio.run(send("使用 恶魔轮盘"))
+    assert result is not None and result.data == "你手中的左轮枪已经装好了子弹，请开枪，或者取消。"
+    # 临时响应在提交后注册
+    assert [handle.state[1] for handle in temp_handles] == [manager.items_library["恶魔轮盘"].id]
@@ -1,6 +1,7 @@
 import asyncio
 from clovers_sarof.core import __plugin__, manager
 from clovers_sarof.core import Event, Rule
+from clovers_sarof.core.account import Session as SQLSession
 from .core import Manager
 
 place = Manager(__plugin__)
@@ -17,7 +18,8 @@ async def _(event: Event):
         return
     if session.at and session.at != user_id:
         return f"现在是 {session.p1_nickname} 发起的对决，请等待比赛结束后再开始下一轮..."
-    with manager.db.session as sql_session:
+
+    def accept(sql_session: SQLSession):
         account = manager.db.account(user_id, group_id, sql_session)
         account.user.connect = group_id
         bet = session.bet
@@ -28,8 +30,15 @@ async def _(event: Event):
             tip = f"对战金额为 {n} {item.name}\n"
         else:
             tip = ""
-        nickname = account.name
-        sql_session.commit()
+        return tip, account.name
+
+    result = await manager.db.run(accept)
+    if isinstance(result, str):
+        return result
+    tip, nickname = result
+    # 等待数据库期间对局可能已被替换或被他人接受
+    if place.session(group_id) is not session or session.p2_uid:
+        return
     session.join(user_id, nickname)
     session.next = session.p1_uid
     game = session.game
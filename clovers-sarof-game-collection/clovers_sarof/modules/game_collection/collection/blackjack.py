@@ -21,7 +21,7 @@ type Session = BaseSession[SessionData]
 
 @place.create(game, ["21点", "黑杰克"])
 async def _(session: Session, arg: str):
-    deck = random_poker()
+    deck = random_poker(rng=session.rng)
     session.data = {"hand1": [deck.pop(0)], "hand2": [deck.pop(0)], "deck": deck}
     return f"唰唰~，随机牌堆已生成。\n{session.create_info}"
 
@@ -24,7 +24,7 @@ type Session = BaseSession[SessionData]
 
 @place.create(game, ["天国骰子"])
 async def _(session: Session, arg: str):
-    array = first_random_dice()
+    array = first_random_dice(session.rng)
     session.data = {
         "pt1": 0,
         "pt1_table": 0,
@@ -84,7 +84,7 @@ async def _(event: Event, session: Session):
             session.data[alive_self] = 6
         else:
             session.data[alive_self] -= actN
-        next_array = session.data[array_self] = [random.randint(1, 6) for _ in range(session.data[alive_self])]
+        next_array = session.data[array_self] = [session.rng.randint(1, 6) for _ in range(session.data[alive_self])]
         if bohemia_dice_pt(next_array)[0] == 0:
             if session.data["last_round"]:
                 session.win = session.p1_uid if session.data["pt1"] > session.data["pt2"] else session.p2_uid
@@ -92,7 +92,7 @@ async def _(event: Event, session: Session):
             else:
                 session.data[pt_table_self] = 0
                 session.data[alive_others] = 6
-                session.data[array_others] = next2_array = first_random_dice()
+                session.data[array_others] = next2_array = first_random_dice(session.rng)
                 session.nextround()
                 return (
                     f"{tip}\n"
@@ -126,7 +126,7 @@ async def _(event: Event, session: Session):
                 session.data["last_round"] = True
                 tip += "\n先手已超分，本轮为最后一轮！"
         session.data[alive_others] = 6
-        session.data[array_others] = next_array = first_random_dice()
+        session.data[array_others] = next_array = first_random_dice(session.rng)
         session.nextround()
         return f"{tip}\n下一个玩家：{next_user}\n桌面：\n{bohemia_show_array(next_array)}"
 
@@ -191,7 +191,7 @@ def bohemia_dice_pt(array: list[int]):
     return pt, actN
 
 
-def first_random_dice():
-    while bohemia_dice_pt(array := [random.randint(1, 6) for _ in range(6)])[0] == 0:
+def first_random_dice(rng: random.Random):
+    while bohemia_dice_pt(array := [rng.randint(1, 6) for _ in range(6)])[0] == 0:
         pass
     return array
@@ -28,7 +28,7 @@ type Session = BaseSession[SessionData]
 async def _(session: Session, arg: str):
     hp = to_int(arg)
     if hp is None or hp > 6 or hp < 3:
-        hp = random.randint(3, 6)
+        hp = session.rng.randint(3, 6)
         tip = ""
     else:
         tip = f"\n本轮对决已设置血量：{hp}"
@@ -147,7 +147,7 @@ async def _(event: Event, session: Session):
             case "过期药品":
                 hp = f"HP{self_key}"
                 assert hp in ("HP1", "HP2")
-                if random.randint(0, 1) == 0:
+                if session.rng.randint(0, 1) == 0:
                     tips += "\n你减少了1滴血"
                     session.data[hp] -= 1
                     if session.data[hp] <= 0:
@@ -175,10 +175,10 @@ async def _(event: Event, session: Session):
                 sum_bullet = len(bullet)
                 sum_real_bullet = sum(bullet)
                 sum_empty_bullet = sum_bullet - sum_real_bullet
-                random_index = random.randint(1, sum_bullet)
+                random_index = session.rng.randint(1, sum_bullet)
                 tips += f"\n弹仓内还有{sum_real_bullet}发实弹,{sum_empty_bullet}发空弹\n接下来第{random_index}发是：{'空弹' if bullet[random_index-1] == 0 else '实弹'}"
             case "箱子":
-                prop1, prop2 = buckshot_roulette_random_props(2)
+                prop1, prop2 = buckshot_roulette_random_props(2, session.rng)
                 session.data[props].append(prop1)
                 session.data[props] = session.data[props][:8]
                 others_props = f"props{others_key}"
@@ -193,18 +193,18 @@ async def _(event: Event, session: Session):
     return use(session, prop_key)
 
 
-def buckshot_roulette_random_bullet(bullet_num: int):
+def buckshot_roulette_random_bullet(bullet_num: int, rng: random.Random):
     """填装一半的子弹"""
     empty_bullet_num = bullet_num // 2
     real_bullet_num = bullet_num - empty_bullet_num
     bullet = [1] * real_bullet_num + [0] * empty_bullet_num
-    random.shuffle(bullet)
+    rng.shuffle(bullet)
     return bullet, real_bullet_num, empty_bullet_num
 
 
-def buckshot_roulette_random_props(props_num: int):
+def buckshot_roulette_random_props(props_num: int, rng: random.Random):
     prop_list = ["手铐", "短锯", "放大镜", "香烟", "啤酒", "逆转器", "过期药品", "肾上腺素", "手机", "箱子"]
-    return random.choices(prop_list, k=props_num)
+    return rng.choices(prop_list, k=props_num)
 
 
 def buckshot_roulette_status(session: Session):
@@ -228,13 +228,13 @@ def buckshot_roulette_status(session: Session):
 
 
 def buckshot_roulette_loading(session: Session):
-    props_num = random.randint(1, 4)
-    session.data["props1"] += buckshot_roulette_random_props(props_num)
+    props_num = session.rng.randint(1, 4)
+    session.data["props1"] += buckshot_roulette_random_props(props_num, session.rng)
     session.data["props1"] = session.data["props1"][:8]
     session.data["buff1"].clear()
-    session.data["props2"] += buckshot_roulette_random_props(props_num)
+    session.data["props2"] += buckshot_roulette_random_props(props_num, session.rng)
     session.data["props2"] = session.data["props2"][:8]
     session.data["buff2"].clear()
-    bullet, real_bullet_num, empty_bullet_num = buckshot_roulette_random_bullet(random.randint(2, 8))
+    bullet, real_bullet_num, empty_bullet_num = buckshot_roulette_random_bullet(session.rng.randint(2, 8), session.rng)
     session.data["bullet"] = bullet
     return f"本轮装弹：\n实弹:{real_bullet_num} 空弹:{empty_bullet_num}"
@@ -32,7 +32,7 @@ async def _(session: Session, arg: str):
         level = 5 if level > 5 else level
     else:
         level = 1
-    deck = random_poker(range_point=(2, 15))
+    deck = random_poker(range_point=(2, 15), rng=session.rng)
 
     if level == 1:
         hand1 = deck[0:5]
@@ -1,4 +1,3 @@
-import random
 from typing import TypedDict
 from ..action import place, Event
 from ..core import Session as BaseSession
@@ -23,10 +22,10 @@ type Session = BaseSession[SessionData]
 @place.create(game, ["摇色子", "摇骰子", "掷色子", "掷骰子"])
 async def _(session: Session, arg: str):
     session.data = {
-        "dice_array1": (dice_array1 := [random.randint(1, 6) for _ in range(5)]),
+        "dice_array1": (dice_array1 := [session.rng.randint(1, 6) for _ in range(5)]),
         "pt1": (pt1 := dice_pt(dice_array1)),
         "array_name1": pt_analyse(pt1),
-        "dice_array2": (dice_array2 := [random.randint(1, 6) for _ in range(5)]),
+        "dice_array2": (dice_array2 := [session.rng.randint(1, 6) for _ in range(5)]),
         "pt2": (pt2 := dice_pt(dice_array2)),
         "array_name2": pt_analyse(pt2),
     }
@@ -3,6 +3,7 @@ from io import BytesIO
 from clovers.config import Config as CloversConfig
 from clovers_sarof.core.linecard import text_to_image
 from clovers_sarof.core import manager
+from clovers_sarof.core.account import Session as SQLSession
 from ...action import place, Event, Rule
 from ...core import Session as BaseSession
 from .core import RaceWorld
@@ -41,7 +42,7 @@ async def _(session: Session, arg: str):
         tip = f"\n> 本场奖金：{n}{prop.name}"
     else:
         tip = ""
-    session.data = RaceWorld(**kwargs)
+    session.data = RaceWorld(**kwargs, rng=session.rng)
     return f"> 创建赛马比赛成功！{tip},\n> 输入 【赛马加入 名字】 即可加入赛马。"
 
 
@@ -56,15 +57,28 @@ async def _(event: Event):
     horsename = event.single_arg()
     if not horsename:
         return "请输入你的马儿名字"
-    if session.bet:
-        item, n = session.bet
-        with manager.db.session as sql_session:
-            account = manager.account(event, sql_session)
-            assert account is not None
+
+    def join(sql_session: SQLSession):
+        account = manager.account(event, sql_session)
+        assert account is not None
+        if session.bet:
+            item, n = session.bet
             if (bn := item.bank(account, sql_session).n) < n:
                 return f"报名赛马需要{n}个{item.name}（你持有的的数量{bn}）"
+        return account.user_id, account.name
+
+    result = await manager.db.run(join)
+    if isinstance(result, str):
+        return result
+    user_id, nickname = result
+    session.log_action(f"{game}/加入", event, user_id=user_id, nickname=nickname)
+    return await join_horse(event, session)
+
+
+@place.step(f"{game}/加入")
+async def join_horse(event: Event, session: Session):
     world: RaceWorld = session.data
-    return world.join_horse(horsename, account.user_id, account.name)
+    return world.join_horse(event.single_arg(), event.user_id, event.nickname)
 
 
 @place.plugin.handle(["赛马开始"], ["user_id", "group_id"])
@@ -86,7 +100,8 @@ async def _(event: Event):
     async def result():
         if session.bet:
             item, n = session.bet
-            with manager.db.session as sql_session:
+
+            def entry_fee(sql_session: SQLSession):
                 for horse in world.racetrack:
                     player = manager.db.account(horse.playeruid, group_id, sql_session)
                     bank = item.bank(player, sql_session)
@@ -94,6 +109,8 @@ async def _(event: Event):
                         bank.n -= n
                     else:
                         bank.n = 0  # 金额不足的 bot 免费提供补齐。此处为特性（
+
+            await manager.db.run(entry_fee)
             yield f"> 比赛开始！\n> 当前奖金：{n}{item.name}"
         else:
             yield f"> 比赛开始！"
@@ -112,18 +129,21 @@ async def _(event: Event):
                 yield "比赛已结束，鉴定为无马生还"
                 return
             # 全员胜利计算
-            if winner := [horse for horse in world.racetrack if horse.location == world.track_length - 1]:
+            if winner := world.winners():
                 yield f"> 比赛结束\n> 正在为您生成战报..."
                 await asyncio.sleep(1)
                 if session.bet:
                     winner_list = []
                     item, n = session.bet
                     n = int(n * len(world.racetrack) / len(winner))
-                    with manager.db.session as sql_session:
+
+                    def bonus(sql_session: SQLSession):
                         for win_horse in winner:
                             winner_list.append(f"> {win_horse.player}")
                             player = manager.db.account(win_horse.playeruid, group_id, sql_session)
                             item.deal(player, n, sql_session)
+
+                    await manager.db.run(bonus)
                     bet = f"\n奖金：{n}{item.name}"
                 else:
                     winner_list = [f"> {win_horse.player}" for win_horse in winner]
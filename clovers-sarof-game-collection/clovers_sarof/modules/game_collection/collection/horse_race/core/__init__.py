@@ -1,6 +1,7 @@
 import random
 from pathlib import Path
 from collections.abc import Callable
+from clovers_sarof.core.tools import AliasSampler
 from .horse import Horse, Event, Event_list
 from .start import load_dlcs
 
@@ -19,7 +20,10 @@ class RaceWorld:
         random_move_range: tuple[int, int],
         range_of_player_numbers: tuple[int, int],
         event_randvalue: int,
+        rng: random.Random | None = None,
     ):
+        self.rng = random.Random() if rng is None else rng
+        """随机数生成器"""
         self.racetrack: list[Horse] = []
         """赛马场跑道"""
         self.track_length = track_length
@@ -76,7 +80,7 @@ class RaceWorld:
                 targets = [horse]
                 target_name_1 = target_name_0
             case 1:
-                target = random.choice([x for x in self.racetrack if not x is horse])
+                target = self.rng.choice([x for x in self.racetrack if not x is horse])
                 targets = [target]
                 target_name_1 = target.horse
             case 2:
@@ -86,17 +90,17 @@ class RaceWorld:
                 targets = [x for x in self.racetrack if not x is horse]
                 target_name_1 = "其他所有马儿"
             case 4:
-                target = random.choice(self.racetrack)
+                target = self.rng.choice(self.racetrack)
                 targets = [target]
                 target_name_1 = target.horse
             case 5:
-                target = random.choice([x for x in self.racetrack if not x is horse])
+                target = self.rng.choice([x for x in self.racetrack if not x is horse])
                 targets = [target, horse]
                 target_name_1 = target.horse
             case 6:
                 index = self.racetrack.index(horse)
                 side = [x for x in [index + 1, index - 1] if 0 <= x < len(self.racetrack)]
-                target = self.racetrack[random.choice(side)]
+                target = self.racetrack[self.rng.choice(side)]
                 targets = [target]
                 target_name_1 = target.horse
             case 7:
@@ -137,7 +141,7 @@ class RaceWorld:
         if event.track_random_location == 1:
             action(
                 targets,
-                lambda horse, random_move_range: horse.location_to(random.randint(*random_move_range)),
+                lambda horse, random_move_range: horse.location_to(self.rng.randint(*random_move_range)),
                 self.random_move_range,
             )
         if event.buff_time_add:
@@ -150,12 +154,12 @@ class RaceWorld:
             location = target.location, horse.location
             horse.location_to(location[0])
             target.location_to(location[1])
-        if random_event_once := event.random_event_once:
+        if event.random_event_once:
             action(
                 targets,
-                lambda horse, describe, event_list: describe.append(self.event_main(horse, self.roll_event(event_list), 1)),
+                lambda horse, describe, sampler: describe.append(self.event_main(horse, self.roll_event(sampler, self.rng), 1)),
                 describe,
-                random_event_once,
+                event.random_event_once_sampler,
             )
         """===============以下为永久事件==============="""
         if event.die == 1:
@@ -177,8 +181,9 @@ class RaceWorld:
                 move_min: int = 0,
                 move_max: int = 0,
                 event_in_buff: Event_list = [],
+                sampler: AliasSampler[Event] | None = None,
             ):
-                horse.add_buff(buff_name, buffs, round_start, round_end, move_min, move_max, event_in_buff)
+                horse.add_buff(buff_name, buffs, round_start, round_end, move_min, move_max, event_in_buff, sampler)
 
             action(
                 targets,
@@ -190,6 +195,7 @@ class RaceWorld:
                 event.move_min,
                 event.move_max,
                 event.random_event,
+                event.random_event_sampler if event.random_event else None,
             )
         """===============以下为延迟事件==============="""
         if delay_event := event.delay_event:
@@ -230,15 +236,9 @@ class RaceWorld:
         return "\n".join(x for x in describe if x)
 
     @staticmethod
-    def roll_event(event_list: Event_list) -> Event:
-        weights = []
-        events = []
-        before_randvalue = 0
-        for randvalue, event in event_list:
-            weights.append(randvalue - before_randvalue)
-            before_randvalue = randvalue
-            events.append(event)
-        return random.choices(events, weights, k=1)[0]
+    def roll_event(sampler: AliasSampler[Event], rng: random.Random | None = None) -> Event:
+        # 抽样表随事件加载构建，保存在来源事件上
+        return sampler.sample(rng)
 
     def nextround(self):
         """
@@ -258,8 +258,8 @@ class RaceWorld:
             horse.delay_events = [(delay_round, delay_event) for delay_round, delay_event in horse.delay_events if delay_round > self.round]
             # buff随机事件触发
             for buff in horse.buff:
-                if buff.event_in_buff:
-                    buff_event = self.roll_event(buff.event_in_buff)
+                if buff.event_sampler is not None:
+                    buff_event = self.roll_event(buff.event_sampler, self.rng)
                     event_log.append(self.event_main(horse, buff_event, 1))
             # 马儿移动,包含死亡/离开/止步判定
             if horse.is_die or horse.is_away:
@@ -268,14 +268,20 @@ class RaceWorld:
                 if horse.is_stop:  # 止步不影响主动事件
                     base_move = 0
                 else:
-                    base_move = horse.base_move(*self.base_move_range)
+                    base_move = horse.base_move(*self.base_move_range, self.rng)
                 # 随机事件判定
-                if random.randint(1, 1000) <= self.event_randvalue:
-                    event = random.choice(self.event_list)
+                if self.rng.randint(1, 1000) <= self.event_randvalue:
+                    event = self.rng.choice(self.event_list)
                     event_log.append(self.event_main(horse, event))
             horse.move(base_move, self.track_length)
         return "\n".join(x for x in event_log if x)
 
+    def winners(self) -> list[Horse]:
+        """
+        到达终点的马儿
+        """
+        return [horse for horse in self.racetrack if horse.location == self.track_length - 1]
+
     def is_die_all(self) -> bool:
         """
         所有马儿是否死亡/离开
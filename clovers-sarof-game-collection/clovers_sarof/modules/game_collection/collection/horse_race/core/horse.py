@@ -1,5 +1,7 @@
 ﻿import random
-from pydantic import BaseModel
+from functools import cached_property
+from pydantic import BaseModel, ConfigDict
+from clovers_sarof.core.tools import AliasSampler
 
 Event_list = list[tuple[int, "Event"]]
 """
@@ -9,6 +11,18 @@ Event_list = list[tuple[int, "Event"]]
 """
 
 
+def event_sampler(event_list: Event_list) -> AliasSampler["Event"]:
+    """按累计概率值构建事件抽样表"""
+    weights = []
+    events = []
+    before_randvalue = 0
+    for randvalue, event in event_list:
+        weights.append(randvalue - before_randvalue)
+        before_randvalue = randvalue
+        events.append(event)
+    return AliasSampler(events, weights)
+
+
 class Event(BaseModel):
     event_name: str = "未知事件"
     """事件名称"""
@@ -81,8 +95,20 @@ class Event(BaseModel):
     replace_horse: dict = {}
     """替换一匹马事件"""
 
+    @cached_property
+    def random_event_once_sampler(self):
+        """一次性随机事件抽样表，事件加载后不再修改"""
+        return event_sampler(self.random_event_once)
+
+    @cached_property
+    def random_event_sampler(self):
+        """持续性随机事件抽样表，事件加载后不再修改"""
+        return event_sampler(self.random_event)
+
 
 class Buff(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     name: str
     """buff名称，turn值>0时为必要值"""
     round_start: int
@@ -99,6 +125,8 @@ class Buff(BaseModel):
     others: 自定义buff_tag，仅标识用buff_tag填写处，也可以填入常规buff_tag并正常生效
     """
     event_in_buff: Event_list
+    event_sampler: AliasSampler | None = None
+    """event_in_buff 的抽样表，沿用来源事件的抽样表"""
 
     def info(self):
         return f"buff名称：{self.name}\n回合：{self.round_start} - {self.round_end}\n标签：{self.buffs}"
@@ -134,10 +162,13 @@ class Horse:
         move_min: int = 0,
         move_max: int = 0,
         event_in_buff=[],
+        sampler: AliasSampler[Event] | None = None,
     ):
         """马儿buff增加"""
         if move_min > move_max:
             move_max = move_min
+        if sampler is None and event_in_buff:
+            sampler = event_sampler(event_in_buff)
         buff = Buff(
             name=buff_name,
             round_start=round_start,
@@ -146,6 +177,7 @@ class Horse:
             move_max=move_max,
             buffs=buffs,
             event_in_buff=event_in_buff,
+            event_sampler=sampler,
         )
         self.buff.append(buff)
 
@@ -185,12 +217,12 @@ class Horse:
         """马儿移动至特定位置计算（事件提供移动）"""
         self.location_add_move = move_to - self.location
 
-    def base_move(self, move_min: int, move_max: int) -> int:
+    def base_move(self, move_min: int, move_max: int, rng: random.Random) -> int:
         """马儿基础移动计算"""
         for buff in self.buff:
             move_min += buff.move_min
             move_max += buff.move_max
-        base_move = random.randint(move_min, move_max)
+        base_move = rng.randint(move_min, move_max)
         return base_move
 
     def move(self, base_move: int, track_length: int):
@@ -78,11 +78,11 @@ class Gamer:
             self.SP = 0 if self.SP < 0 else self.SP
         return msg
 
-    def action_active(self, index: int) -> list[str]:
+    def action_active(self, index: int, rng: random.Random) -> list[str]:
         msg = []
         suit, point = self.hand[index]
         if point == 1:
-            roll = random.randint(1, 6)
+            roll = rng.randint(1, 6)
             msg.append(f"发动ACE技能！六面骰子判定为 {roll}")
             msg += self.action_ACE(roll)
         else:
@@ -96,7 +96,7 @@ class Gamer:
                 case 3:
                     self.SP += point
                     msg.append(f"♣技能点增加了{point}")
-                    roll = random.randint(1, 20)
+                    roll = rng.randint(1, 20)
                     msg.append(f"二十面骰判定为{roll}点，当前技能点{self.SP}")
                     if self.SP < roll:
                         msg.append("技能发动失败...")
@@ -142,7 +142,7 @@ type Session = BaseSession[SessionData]
 
 @place.create(game, ["扑克对战"])
 async def _(session: Session, arg: str):
-    deck = random_poker(2)
+    deck = random_poker(2, rng=session.rng)
     session.data = {"ACT": False, "deck": deck[3:], "P1": Gamer(deck[:3], 20), "P2": Gamer([], 25, SP=2)}
     session.start_tips = f"P1初始手牌\n{session.data["P1"].handcard}"
     return f"唰唰~，随机牌堆已生成\n{session.create_info}"
@@ -166,9 +166,9 @@ async def _(event: Event, session: Session):
         active = session.data["P2"]
         passive = session.data["P1"]
         passive_name = session.p1_nickname
-    msg = active.action_active(index)
+    msg = active.action_active(index, session.rng)
     if passive.SP > 1:
-        roll = random.randint(1, 20)
+        roll = session.rng.randint(1, 20)
         msg.append(f"{passive_name} 二十面骰判定为{roll}点，当前技能点{passive.SP}")
         if passive.SP < roll:
             msg.append("技能发动失败...")
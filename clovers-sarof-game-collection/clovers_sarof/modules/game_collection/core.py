@@ -1,13 +1,15 @@
 import time
+import random
 import asyncio
 from typing import Any
 from collections.abc import Coroutine, Callable, Sequence, Iterable
+from clovers import Event as BaseEvent
 from clovers.core import Plugin, PluginCommand
 from clovers.config import Config as CloversConfig
 from clovers_sarof.core import Event, Rule
 from clovers_sarof.core import manager
 from clovers_sarof.core import GOLD
-from clovers_sarof.core.account import Item
+from clovers_sarof.core.account import Item, Session as SQLSession
 from clovers_sarof.core.linecard import card_template
 from clovers_sarof.core.tools import to_int
 from .config import Config
@@ -21,6 +23,9 @@ config_data.update(__config__.model_dump())
 default_bet = __config__.default_bet
 timeout = __config__.timeout
 
+type Action = tuple[str, dict[str, Any], str, list[str]]
+"""(步骤名, 事件属性, 消息原文, 指令参数)"""
+
 
 class Session[Data]:
     """
@@ -45,13 +50,49 @@ class Session[Data]:
     end_tips: str | None = None
     start_tips: Any = None
 
-    def __init__(self, group_id: str, user_id: str, nickname: str, game: str):
+    arg: str = ""
+    """创建场次时的参数"""
+    headless: bool = False
+    """离线回放，结束时不结算"""
+
+    def __init__(self, group_id: str, user_id: str, nickname: str, game: str, seed: int | None = None):
         self.time = time.time()
         self.group_id = group_id
         self.p1_uid = user_id
         self.p1_nickname = nickname
         self.next = user_id
         self.game = game
+        self.seed = random.getrandbits(64) if seed is None else seed
+        """随机数种子"""
+        self.rng = random.Random(self.seed)
+        """本场游戏的随机数生成器，游戏内的随机都从这里取"""
+        self.log: list[Action] = []
+        """动作记录"""
+
+    def log_action(self, step: str, event: Event, **properties):
+        """
+        记录动作
+            properties: 覆盖事件属性
+        """
+        self.log.append((step, {**event.properties, **properties}, event.message, list(event.args)))
+
+    @property
+    def record(self) -> dict[str, Any]:
+        """场次记录，可以交给 Manager.replay 离线回放"""
+        return {
+            "game": self.game,
+            "seed": self.seed,
+            "group_id": self.group_id,
+            "arg": self.arg,
+            "p1_uid": self.p1_uid,
+            "p1_nickname": self.p1_nickname,
+            "p2_uid": self.p2_uid,
+            "p2_nickname": self.p2_nickname,
+            "at": self.at,
+            "bet": (self.bet[0].id, self.bet[1]) if self.bet else None,
+            "win": self.win,
+            "log": list(self.log),
+        }
 
     def __repr__(self) -> str:
         return f"Session({self.game}, group_id={self.group_id})"
@@ -116,7 +157,7 @@ class Session[Data]:
         else:
             return f"{tip}{self.p1_nickname} 发起挑战！\n回复 接受挑战 即可开始对局。\n【{timeout}秒内有效】"
 
-    def settle(self):
+    def settle(self, session: SQLSession):
         """
         游戏结束结算
             return:结算界面
@@ -132,39 +173,20 @@ class Session[Data]:
             lose = self.p1_uid
             lose_name = self.p1_nickname
 
-        with manager.db.session as session:
-            # 胜者
-            winner = manager.db.user(win, session)
-            # 获胜数据
-            winner.extra["win"] = winner.extra.get("win", 0) + 1
-            win_streak = winner.extra.get("win_streak", 0) + 1
-            winner.extra["win_streak"] = win_streak
-            winner.extra["win_streak_max"] = max(winner.extra.get("win_streak_max", 0), win_streak)
-            # 中断连败
-            winner.extra.setdefault("lose", 0)
-            winner.extra["lose_streak"] = 0
-            winner.extra.setdefault("lose_streak_max", 0)
-            # 败者
-            loser = manager.db.user(lose, session)
-            # 失败数据
-            loser.extra["lose"] = loser.extra.get("lose", 0) + 1
-            lose_streak = loser.extra.get("lose_streak", 0) + 1
-            loser.extra["lose_streak"] = lose_streak
-            loser.extra["lose_streak_max"] = max(loser.extra.get("lose_streak_max", 0), lose_streak)
-            # 中断连胜
-            loser.extra.setdefault("win", 0)
-            loser.extra["win_streak"] = 0
-            loser.extra.setdefault("win_streak_max", 0)
-            card = (
-                f"[pixel 20]◆胜者 {win_name}[pixel 460]◇败者 {lose_name}\n"
-                f"[pixel 20]◆战绩 {winner.extra["win"]}:{winner.extra["lose"]}[pixel 460]◇战绩 {loser.extra["win"]}:{loser.extra["lose"]}\n"
-                f"[pixel 20]◆连胜 {winner.extra["win_streak"]}[pixel 460]◇连败 {loser.extra["lose_streak"]}"
-            )
-            info = [card_template(card, "对战")]
-            bet = self.bet
-            if bet is not None:
-                tip = manager.transfer(*bet, lose, win, group_id, session, force=True)
-                info.append(card_template(tip[1], "结算", autowrap=True))
+        winner = manager.db.stats(win, session)
+        winner.record_win()
+        loser = manager.db.stats(lose, session)
+        loser.record_lose()
+        card = (
+            f"[pixel 20]◆胜者 {win_name}[pixel 460]◇败者 {lose_name}\n"
+            f"[pixel 20]◆战绩 {winner.win}:{winner.lose}[pixel 460]◇战绩 {loser.win}:{loser.lose}\n"
+            f"[pixel 20]◆连胜 {winner.win_streak}[pixel 460]◇连败 {loser.lose_streak}"
+        )
+        info = [card_template(card, "对战")]
+        bet = self.bet
+        if bet is not None:
+            tip = manager.transfer(*bet, lose, win, group_id, session, force=True)
+            info.append(card_template(tip[1], "结算", autowrap=True))
         result = [f"这场对决是 {win_name} 胜利了", manager.info_card(info, win)]
         if self.end_tips:
             result.append(self.end_tips)
@@ -172,13 +194,15 @@ class Session[Data]:
 
     def end(self, result=None):
         self.time = -1
-        settle = self.settle()
+        if self.headless:
+            return result
+        settle = asyncio.ensure_future(manager.db.run(self.settle))
 
         async def output():
             if result:
                 yield result
                 await asyncio.sleep(1)
-            for x in settle:
+            for x in await settle:
                 yield x
                 await asyncio.sleep(1)
 
@@ -190,6 +214,10 @@ class Manager:
         self.place: dict[str, Session] = {}
         self.plugin = plugin
         self.info: dict[str, str] = {}
+        self.creators: dict[str, Callable[[Session, str], Coroutine]] = {}
+        """游戏名 -> 创建场次"""
+        self.steps: dict[str, Callable[[Event, Session], Coroutine]] = {}
+        """步骤名 -> 可回放的动作"""
 
     def session(self, group_id: str):
         if not (session := self.place.get(group_id)):
@@ -221,6 +249,39 @@ class Manager:
                     n = 0
                 return arg, n, name
 
+    def step(self, name: str):
+        """注册可回放的动作"""
+
+        def decorator(func: Callable[[Event, Session], Coroutine]):
+            self.steps[name] = func
+            return func
+
+        return decorator
+
+    async def replay(self, record: dict[str, Any]):
+        """
+        离线回放场次记录
+            用记录的种子重建场次，依次执行记录的动作，不读写数据库，不需要适配器
+            return: (场次, [每一步的输出])
+        """
+        game = record["game"]
+        session = Session(record["group_id"], record["p1_uid"], record["p1_nickname"], game, seed=record["seed"])
+        session.headless = True
+        session.arg = record["arg"]
+        session.at = record["at"]
+        session.p2_nickname = record["p2_nickname"]
+        if bet := record["bet"]:
+            item_id, n = bet
+            session.bet = (manager.items_library[item_id], n)
+        outputs = [await self.creators[game](session, session.arg)]
+        if p2_uid := record["p2_uid"]:
+            session.join(p2_uid, record["p2_nickname"])
+            session.next = session.p1_uid
+        for step, properties, message, args in record["log"]:
+            session.log_action(step, event := Event(BaseEvent(message, args, properties, {}, {})))
+            outputs.append(await self.steps[step](event, session))
+        return session, outputs
+
     def create(
         self,
         game: str,
@@ -233,6 +294,8 @@ class Manager:
             _properties.update(properties)
 
         def decorator(func: Callable[[Session, str], Coroutine]):
+            self.creators[game] = func
+
             @self.plugin.handle(command, _properties, rule=Rule.group, priority=priority)
             async def wrapper(event: Event):
                 user_id = event.user_id
@@ -242,19 +305,31 @@ class Manager:
                 arg, n, prop_name = self.args_parse(event.args)
                 if n < 0:
                     n = default_bet
-                with manager.db.session as sql_session:
+
+                def prepare(sql_session: SQLSession):
                     account = manager.db.account(user_id, group_id, sql_session)
+                    item = None
                     if n > 0:
                         item = manager.items_library.get(prop_name, GOLD)
                         if (bank_n := item.bank(account, sql_session).n) < n:
                             return f"你没有足够的{item.name}支撑这场对决({bank_n})。"
-                    nickname = account.nickname
-                    session = self.place[group_id] = Session(group_id, user_id, nickname, game=game)
-                    if n > 0:
-                        session.bet = (item, n)
-                    if event.at:
-                        session.at = event.at[0]
-                        session.p2_nickname = manager.db.account(session.at, group_id, sql_session).nickname
+                    p2_nickname = manager.db.account(event.at[0], group_id, sql_session).nickname if event.at else None
+                    return account.nickname, item, p2_nickname
+
+                result = await manager.db.run(prepare)
+                if isinstance(result, str):
+                    return result
+                nickname, item, p2_nickname = result
+                # 等待数据库期间可能已有对局被创建或接受
+                if (session := self.session(group_id)) and (tip := session.cover_check(user_id)):
+                    return tip
+                session = self.place[group_id] = Session(group_id, user_id, nickname, game=game)
+                if item is not None:
+                    session.bet = (item, n)
+                if event.at:
+                    session.at = event.at[0]
+                    session.p2_nickname = p2_nickname
+                session.arg = arg
                 return await func(session, arg)
 
             return wrapper
@@ -271,29 +346,33 @@ class Manager:
         _properties = {"user_id", "group_id"}
         if properties:
             _properties.update(properties)
+        if isinstance(command, str):
+            label = command
+        elif isinstance(command, Iterable):
+            label = " | ".join(command)
+        elif command is None:
+            label = "任何指令"
+        else:
+            label = command.pattern
         if not game in self.info:
-            if isinstance(command, Iterable):
-                self.info[game] = " | ".join(command)
-            elif isinstance(command, str):
-                self.info[game] = command
-            elif command is None:
-                self.info[game] = "任何指令"
-            else:
-                self.info[game] = command.pattern
+            self.info[game] = label
+        step = f"{game}/{label}"
 
         def decorator(func: Callable[[Event, Session], Coroutine]):
+            self.step(step)(func)
+
             @self.plugin.handle(command, _properties, priority=priority)
             async def wrapper(event: Event):
                 user_id = event.user_id
                 group_id = event.group_id
                 if group_id is None:
-                    with manager.db.session as sql_session:
-                        group_id = manager.db.user(user_id, sql_session).connect
+                    group_id = await manager.db.run(lambda sql_session: manager.db.user(user_id, sql_session).connect)
                 session = self.place.get(group_id)
                 if not session or session.game != game or session.time == -1:
                     return
                 if tip := session.action_check(user_id):
                     return tip
+                session.log_action(step, event)
                 return await func(event, session)
 
             return wrapper
@@ -3,13 +3,14 @@ import random
 type PokerCard = tuple[int, int]
 
 
-def random_poker(n: int = 1, range_point: tuple[int, int] = (1, 14)) -> list[PokerCard]:
+def random_poker(n: int = 1, range_point: tuple[int, int] = (1, 14), rng: random.Random | None = None) -> list[PokerCard]:
     """
     生成随机牌库
+        rng: 随机数生成器，默认使用 random 模块
     """
     poker_deck = [(suit, point) for suit in range(1, 5) for point in range(*range_point)]
     poker_deck = poker_deck * n
-    random.shuffle(poker_deck)
+    (random if rng is None else rng).shuffle(poker_deck)
     return poker_deck
 
 
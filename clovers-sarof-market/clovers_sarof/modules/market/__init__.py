@@ -1,22 +1,27 @@
 import time
-import heapq
 import math
 import random
 import asyncio
 from datetime import datetime
 from io import BytesIO
+import numpy as np
+from sqlmodel import select, func, insert, update, delete, col, and_, true, literal
+from sqlalchemy import bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from linecard import ImageList
 from clovers import TempHandle
 from clovers.logger import logger
 from clovers.config import Config as CloversConfig
 from clovers_apscheduler import scheduler
 from clovers_sarof.core import __plugin__ as plugin, Event, Rule
-from clovers_sarof.core import manager, client
+from clovers_sarof.core import manager, avatars
 from clovers_sarof.core import GOLD, STD_GOLD, REVOLUTION_MARKING
-from clovers_sarof.core.account import Stock, Account, User, Group, Exchange, AccountBank, UserBank, GroupBank
-from clovers_sarof.core.linecard import card_template, avatar_list, item_info, item_card, stock_card
-from clovers_sarof.core.tools import format_number, to_int, download_url
-from .tools import gini_coef, item_name_rule
+from clovers_sarof.core.account import Session, Stock, StockRecord, Account, User, Group, Exchange, AccountBank, UserBank, GroupBank
+from clovers_sarof.core.linecard import card_template, avatar_list, item_info, item_card, stock_card, candlestick_cache
+from clovers_sarof.core.tools import format_number, to_int
+from .tools import item_name_rule, settle_exchange, purchase_plan
+from .orderbook import OrderBook
+from .wealth import WealthStats
 from .config import Config
 
 
@@ -30,60 +35,104 @@ revolt_gini = __config__.revolt_gini
 gini_filter_gold = __config__.gini_filter_gold
 revolt_cd = __config__.revolt_cd
 company_public_gold = __config__.company_public_gold
+record_retention = __config__.record_retention
+
+book = OrderBook()
+"""交易市场订单簿"""
+wealth_stats = WealthStats(GOLD.id)
+"""各群金币统计"""
+with manager.db.session as session:
+    book.load(session)
+
+
+@manager.on_restore
+def _():
+    book.clear()
+    with manager.db.session as session:
+        book.load(session)
+
+
+@manager.on_restore
+def _():
+    candlestick_cache.clear()
+
+
+@manager.on_restore
+def _():
+    wealth_stats.clear()
 
 
 @plugin.handle(["发起重置"], ["group_id"], rule=Rule.group)
 async def _(event: Event):
     group_id: str = event.group_id  # type: ignore
-    with manager.db.session as session:
+
+    def revolution(session: Session):
         group = session.get(Group, group_id)
         if group is None:
             return "群组不存在。"
-        banks = session.exec(
-            AccountBank.select()
-            .join(Account)
-            .where(
-                Account.group_id == group.id,
-                AccountBank.item_id == GOLD.id,
-                AccountBank.n > gini_filter_gold,
-            )
-        ).all()
-        wealths = [x.n for x in banks]
-        if (sum_wealths := sum(wealths)) < company_public_gold:
+        wealth = wealth_stats.group(group.id, session)
+        _, sum_wealths, gini = wealth.stats(gini_filter_gold)
+        if sum_wealths < company_public_gold:
             return f"本群金币（{sum_wealths}）小于{company_public_gold}，未满足重置条件。"
-        if (gini := gini_coef(wealths)) < revolt_gini:
-            return f"当前基尼系数为{gini:f3}，未满足重置条件。"
-        ranklist = heapq.nlargest(10, banks, key=lambda x: x.n)
+        if gini < revolt_gini:
+            return f"当前基尼系数为{gini:.3f}，未满足重置条件。"
+        account_ids = [account_id for account_id, _ in wealth.top(10, gini_filter_gold)]
+        query = AccountBank.select().where(AccountBank.item_id == GOLD.id, col(AccountBank.bound_id).in_(account_ids))
+        banks = {bank.bound_id: bank for bank in session.exec(query).all()}
+        ranklist = [banks[account_id] for account_id in account_ids if account_id in banks]
         top = ranklist[0]
         REVOLUTION_MARKING.deal(top.account, 1, session)
         for i, bank in enumerate(ranklist):
             bank.n = int(bank.n * i / 10)
-            bank.account.extra["revolution"] = False
+            bank.account.revolution = False
         rate = group.level / group.level + 1
         for bank in group.bank:
             if manager.items_library[bank.item_id].domain == 1:
                 bank.n = int(bank.n * rate)
         group.level += 1
-        session.commit()
         nickname = top.account.nickname
-    return f"当前系数为：{gini:f3}，重置成功！恭喜{nickname}进入挂件榜☆！重置签到已刷新。"
+        return f"当前系数为：{gini:.3f}，重置成功！恭喜{nickname}进入挂件榜☆！重置签到已刷新。"
+
+    return await manager.db.run(revolution)
+
+
+@plugin.handle(["财富统计", "基尼系数"], ["user_id"])
+async def _(event: Event):
+    def query(session: Session):
+        stats = wealth_stats.load(session)
+        names = session.exec(select(Group.id, Group.name, Stock.name).outerjoin(Stock).where(col(Group.id).in_(list(stats)))).all()
+        nicknames = {group_id: stock_name or group_name or group_id for group_id, group_name, stock_name in names}
+        data = []
+        for group_id, wealth in stats.items():
+            count, total, gini = wealth.stats(gini_filter_gold)
+            if count > 0:
+                data.append((gini, nicknames.get(group_id, group_id), count, total))
+        data.sort(key=lambda x: x[0], reverse=True)
+        return data
+
+    data = await manager.db.run(query)
+    if not data:
+        return "没有统计数据"
+    info = "\n".join(f"{name}[pixel 420]{count}人[pixel 560]{format_number(total)}[pixel 760]{gini:.3f}" for gini, name, count, total in data)
+    return manager.info_card([card_template(info, "财富统计")], event.user_id)
 
 
 @plugin.handle(["重置签到", "领取金币"], ["user_id", "group_id", "nickname", "avatar"])
 async def _(event: Event):
-    with manager.db.session as session:
+    def sign_in(session: Session):
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
         if avatar_url := event.avatar:
             account.user.avatar_url = avatar_url
-        if not account.extra.setdefault("revolution", True):
+        if not account.revolution:
             return "你没有待领取的金币"
         n = random.randint(*revolt_gold)
         GOLD.deal(account, n, session)
-        account.extra["revolution"] = False
-        session.commit()
-    return f"这是你重置后获得的金币！你获得了 {n} 金币"
+        account.revolution = False
+        return f"这是你重置后获得的金币！你获得了 {n} 金币"
+
+    return await manager.db.run(sign_in)
 
 
 @plugin.handle(["金币转"], ["user_id", "group_id", "nickname"])
@@ -96,7 +145,8 @@ async def _(event: Event):
             if not (len(args) == 1 and args[0].isdigit()):
                 return "请输入正确的数量"
             n = int(args[0])
-            with manager.db.session as session:
+
+            def transaction(session: Session):
                 account = manager.account(event, session)
                 if account is None:
                     return "无法在当前会话创建账户。"
@@ -106,13 +156,15 @@ async def _(event: Event):
                 if (tn := STD_GOLD.deal(account, -n_std, session)) is not None:
                     return f"你的账户中没有足够的{STD_GOLD.name}（{tn}）。"
                 GOLD.deal(account, n, session)
-                session.commit()
                 return f"你成功将{n_std}枚{STD_GOLD.name}兑换为{n}枚{GOLD.name}"
+
+            return await manager.db.run(transaction)
         case "出":
             if not (len(args) == 1 and args[0].isdigit()):
                 return "请输入正确的数量"
             n = int(args[0])
-            with manager.db.session as session:
+
+            def transaction(session: Session):
                 account = manager.account(event, session)
                 if account is None:
                     return "无法在当前会话创建账户。"
@@ -122,12 +174,14 @@ async def _(event: Event):
                 if (tn := GOLD.deal(account, -n, session)) is not None:
                     return f"你的账户中没有足够的{GOLD.name}（{tn}）。"
                 STD_GOLD.deal(account, n, session)
-                session.commit()
                 return f"你成功将{n}枚{GOLD.name}兑换为{n_std}枚{STD_GOLD.name}"
+
+            return await manager.db.run(transaction)
         case "转移":
             if not (len(args) == 2 and (n := to_int(args[1]))):
                 return "请输入正确的目标账户所在群及数量"
-            with manager.db.session as session:
+
+            def transaction(session: Session):
                 account = manager.account(event, session)
                 if account is None:
                     return "无法在当前会话创建账户。"
@@ -155,7 +209,6 @@ async def _(event: Event):
                         return f"你的账户中没有足够的{GOLD.name}（{tn}）。"
                     receipt = int(n * exrate)
                     GOLD.deal(target_account, receipt, session)
-                    session.commit()
                     return f"{account.nickname} 向 目标账户:{group_name} 发送 {n} {GOLD.name}\n汇率 {exrate:3f}\n实际收到 {receipt}"
                 else:
                     exrate = level / account.group.level
@@ -163,9 +216,10 @@ async def _(event: Event):
                         return f"你的目标账户中没有足够的{GOLD.name}（{tn}）。"
                     receipt = int(n * exrate)
                     GOLD.deal(account, receipt, session)
-                    session.commit()
                     return f"目标账户:{group_name} 向 {account.nickname} 发送 {n} {GOLD.name}\n汇率 {exrate:3f}\n实际收到 {receipt}"
 
+            return await manager.db.run(transaction)
+
 
 @plugin.handle(["群金库", "群仓库"], ["user_id", "group_id", "permission"], rule=Rule.group)
 async def _(event: Event):
@@ -177,22 +231,29 @@ async def _(event: Event):
     group_id: str = event.group_id  # type: ignore
     user_id = event.user_id
     if command == "查看":
-        with manager.db.session as session:
+
+        def query(session: Session):
             group = session.get(Group, group_id)
             if group is None:
                 return "群组不存在。"
-            item_data, stock_data = manager.bank_data(group.bank, session)
-            imagelist: ImageList = []
-            if item_data:
-                if len(item_data) < 6:
-                    imagelist.extend(item_info(item_data))
-                else:
-                    imagelist.append(card_template(item_card(item_data), "群仓库"))
-            if stock_data:
-                imagelist.append(card_template(stock_card(stock_data), "群投资"))
+            return manager.bank_data(group.bank, session)
+
+        result = await manager.db.run(query)
+        if isinstance(result, str):
+            return result
+        item_data, stock_data = result
+        imagelist: ImageList = []
+        if item_data:
+            if len(item_data) < 6:
+                imagelist.extend(item_info(item_data))
+            else:
+                imagelist.append(card_template(item_card(item_data), "群仓库"))
+        if stock_data:
+            imagelist.append(card_template(stock_card(stock_data), "群投资"))
         return manager.info_card(imagelist, user_id) if imagelist else "群仓库是空的"
     sign, name = command[0], command[1:]
-    with manager.db.session as session:
+
+    def transaction(session: Session):
         if (item := (manager.items_library.get(name) or Stock.find(name, session))) is None:
             return f"没有名为 {name} 的道具或股票。"
         group = session.get(Group, group_id)
@@ -212,6 +273,8 @@ async def _(event: Event):
             item.deal(account, n, session)
             return f"你在群仓库取出了{n}个{item.name}"
 
+    return await manager.db.run(transaction)
+
 
 async def corp_rename(event: Event, handle: TempHandle):
     handle.finish()
@@ -219,12 +282,14 @@ async def corp_rename(event: Event, handle: TempHandle):
         return "重命名已取消"
     state: tuple[str, str] = handle.state  # type: ignore
     stock_id, stock_name = state
-    with manager.db.session as session:
+
+    def rename(session: Session):
         stock = session.get(Stock, stock_id)
         if stock is None:
             return f"{stock_id} 已被注销"
         stock.name = stock_name
-        session.commit()
+
+    return await manager.db.run(rename)
 
 
 @plugin.handle(
@@ -241,17 +306,15 @@ async def _(event: Event):
         return check
     if stock_name in manager.items_library:
         return f"注册名 {stock_name} 与已有物品重复"
-    with manager.db.session as session:
+
+    def listed(session: Session):
         if Stock.find(stock_name, session) is not None:
             return f"{stock_name} 已被其他群注册"
         group = manager.db.group(group_id, session)
         if stock := group.stock:
-            rule: list[Rule.Checker] = [Rule.identify(event.user_id, group_id), lambda event: event.message in "是否"]
-            plugin.temp_handle(["user_id", "group_id", "permission"], rule=rule, state=(stock.id, stock_name))(corp_rename)
-            return f"本群已在市场注册，注册名：{stock.name}，是否修改？【是/否】"
+            return stock.id, stock.name
         if group_avatar := event.group_avatar:
             group.avatar_url = group_avatar
-        session.commit()
         group_bank = session.exec(GroupBank.select_item(group.id, GOLD.id)).one_or_none()
         if group_bank is None or (n := group_bank.n) < company_public_gold:
             n = n if group_bank else 0
@@ -272,8 +335,43 @@ async def _(event: Event):
         stock_value += sum(bank.n for bank in banks) * group.level
         stock.reset_value(stock_value)
         price = stock_value / stock.issuance
-        session.commit()
-    return f"{stock_name}发行成功，发行价格为{format_number(price)}金币"
+        return f"{stock_name}发行成功，发行价格为{format_number(price)}金币"
+
+    result = await manager.db.run(listed)
+    if isinstance(result, str):
+        return result
+    stock_id, listed_name = result
+    rule: list[Rule.Checker] = [Rule.identify(event.user_id, group_id), lambda event: event.message in "是否"]
+    plugin.temp_handle(["user_id", "group_id", "permission"], rule=rule, state=(stock_id, stock_name))(corp_rename)
+    return f"本群已在市场注册，注册名：{listed_name}，是否修改？【是/否】"
+
+
+def match_asks(stock: Stock, user_id: str, count: int, max_price: float, budget: float, session: Session):
+    """
+    按价格、时间优先买入市场上的卖单
+        max_price: 最高单价
+        return: 买入数量, 总价
+    """
+    buy_n = 0
+    cost = 0.0
+    for quote, _, order_id in book.iter_asks(stock.id):
+        if buy_n >= count or quote > max_price:
+            break
+        exchange = session.get(Exchange, order_id)
+        if exchange is None or exchange.user_id == user_id or exchange.quote != quote:
+            continue
+        seller_bank = session.bank(UserBank, exchange.user_id, stock.id)
+        if seller_bank.n <= 0:
+            session.delete(exchange)
+            continue
+        if (settle := min(count - buy_n, exchange.n, seller_bank.n, int((budget - cost) // quote))) <= 0:
+            break
+        seller_id = exchange.user_id
+        exchange.deal(settle, session)
+        STD_GOLD.bank_deal(session.bank(UserBank, seller_id, STD_GOLD.id), int(settle * quote), session)
+        buy_n += settle
+        cost += settle * quote
+    return buy_n, cost
 
 
 @plugin.handle(["购买", "发行购买"], ["user_id", "group_id", "nickname"])
@@ -281,66 +379,68 @@ async def _(event: Event):
     if not (args := event.args_parse()):
         return
     stock_name, buy_count, quote = args
-    with manager.db.session as session:
+
+    def purchase(session: Session):
         if (stock := Stock.find(stock_name, session)) is None:
             return f"没有 {stock_name} 的注册信息"
-        if not (price := stock.price) > 0:
+        if not stock.price > 0:
             return "股票价格异常，无法结算。"
         account = manager.account(event, session)
         if account is None:
             return "无法在当前会话创建账户。"
         group_bank: GroupBank | None = stock.group.item(stock.id, session).one_or_none()  # type: ignore
-        if group_bank is None or group_bank.n <= 0:
-            return "已售空，请等待结算。"
+        group_n = group_bank.n if group_bank is not None else 0
         level = account.group.level
         my_std_bank = STD_GOLD.bank(account, session)
         my_gold_bank = GOLD.bank(account, session)
 
         std_total = my_std_bank.n + my_gold_bank.n * level
-        std_cost = 0
-        buy_n = 0
-
-        stock_value = stock.value
-        stock_floating = stock.floating
-        stock_issuance = stock.issuance
-        n = group_bank.n
-        quote = quote if quote > 0 else float("inf")
-        for _ in range(buy_count):
-            if price > quote:
-                break
-            buy_n += 1
-            std_cost += price
-            if buy_n > n:
-                break
-            if std_cost > std_total:
-                buy_n -= 1
-                std_cost -= price
-                break
-            stock_value += price
-            price = max(stock_value, stock_floating) / stock_issuance
-        std_cost = math.ceil(std_cost)
-
-        stock.corp_deal(stock.group, -buy_n, session)
+        # 先买入报价不高于发行价的卖单，再向公司购买
+        max_price = quote if quote > 0 else float("inf")
+        market_n, market_cost = match_asks(
+            stock,
+            account.user_id,
+            buy_count,
+            min(max_price, stock.price) if group_n > 0 else max_price,
+            std_total,
+            session,
+        )
+        if market_n == 0 and group_n <= 0:
+            return "已售空，请等待结算。"
+        issue_n, issue_cost = purchase_plan(
+            stock.value,
+            stock.floating,
+            stock.issuance,
+            min(buy_count - market_n, group_n),
+            quote,
+            std_total - market_cost,
+        )
+        issue_cost = math.ceil(issue_cost)
+        buy_n = market_n + issue_n
+        std_cost = math.ceil(market_cost) + issue_cost
+
+        stock.corp_deal(stock.group, -issue_n, session)
         stock.deal(account, buy_n, session)
-        STD_GOLD.corp_deal(stock.group, std_cost, session)
+        STD_GOLD.corp_deal(stock.group, issue_cost, session)
 
-        std_cost = math.ceil(std_cost)
         tip = f"【购买:{stock_name}】使用了 {std_cost} 枚 {STD_GOLD.name}"
         if std_cost < my_std_bank.n:
             my_std_bank.n -= std_cost
             session.add(my_std_bank)
         else:
-            std_cost -= my_std_bank.n
-            if _bank := session.get(UserBank, STD_GOLD.id):
-                session.delete(_bank)
-            if std_cost > 0:
-                my_gold_bank.n -= math.ceil(std_cost / level)
-                if my_gold_bank.n < 0:
-                    my_gold_bank.n = 0
+            gold_cost = std_cost - my_std_bank.n
+            my_std_bank.n = 0
+            if gold_cost > 0:
+                my_gold_bank.n = max(my_gold_bank.n - math.ceil(gold_cost / level), 0)
                 session.add(my_gold_bank)
-                tip += f"，其中{std_cost}枚来自购买群账户，汇率（{level}）"
+                tip += f"，其中{gold_cost}枚来自购买群账户，汇率（{level}）"
         account.user.post_message(tip)
-        session.commit()
+        return buy_n, std_cost
+
+    result = await manager.db.run(purchase)
+    if isinstance(result, str):
+        return result
+    buy_n, std_cost = result
     if buy_n > 0:
         card_template(
             f"{stock_name}\n----\n数量：{buy_n}\n单价：{std_cost / buy_n :.2f}\n总计：{std_cost}",
@@ -357,7 +457,8 @@ async def _(event: Event):
     if not (args := event.args_parse()):
         return
     stock_name, n, quote = args
-    with manager.db.session as session:
+
+    def sell(session: Session):
         if (stock := Stock.find(stock_name, session)) is None:
             return f"没有 {stock_name} 的注册信息"
         account = manager.account(event, session)
@@ -384,8 +485,14 @@ async def _(event: Event):
         else:
             exchange.n = n
             exchange.quote = quote
+            exchange.time = datetime.now()
             tip = "交易信息已修改。"
-        session.commit()
+        return stock.name, tip
+
+    result = await manager.db.run(sell)
+    if isinstance(result, str):
+        return result
+    stock_name, tip = result
     card_template(
         f"{stock_name}\n----\n报价：{quote or '自动出售'}\n数量：{n}",
         tip,
@@ -398,23 +505,32 @@ async def _(event: Event):
 @plugin.handle(["市场信息"], ["user_id"])
 async def _(event: Event):
     if stock_name := event.single_arg():
-        with manager.db.session as session:
+
+        def query(session: Session):
             if (stock := Stock.find(stock_name, session)) is None:
                 return f"没有 {stock_name} 的注册信息"
             exchanges = stock.market(session, limit=20)
             if not exchanges:
                 return "没有交易信息。"
-            avatar_urls, infos = zip(*((e.user.avatar_url, f"报价：{e.quote}[pixel 580]数量：{e.n}") for e in exchanges))
-        avatars = await asyncio.gather(*(download_url(avatar, client) for avatar in avatar_urls))
-        imagelist = avatar_list(zip(avatars, infos))
+            return [(e.user.avatar_url, f"报价：{e.quote}[pixel 580]数量：{e.n}") for e in exchanges]
+
+        result = await manager.db.run(query)
+        if isinstance(result, str):
+            return result
+        avatar_urls, infos = zip(*result)
+        avatar_data = await asyncio.gather(*(avatars.get(url) for url in avatar_urls))
+        imagelist = avatar_list(zip(avatar_data, infos))
     else:
-        with manager.db.session as session:
+
+        def query(session: Session):
             all_stocks = session.exec(Stock.select()).all()
             data = [(stock, bank.n) for stock in all_stocks if (bank := stock.group.item(stock.id, session).one_or_none())]
-            if not data:
-                return "市场为空"
             data.sort(key=lambda x: x[0].value, reverse=True)
-            stock_card_info = stock_card(data)
+            return data
+
+        if not (data := await manager.db.run(query)):
+            return "市场为空"
+        stock_card_info = stock_card(data)
         imagelist = [card_template(stock_card_info, "市场信息")]
     return manager.info_card(imagelist, event.user_id)
 
@@ -434,7 +550,7 @@ async def _(event: Event):
     else:
         return "请输入:被继承群 -> 继承群"
 
-    with manager.db.session as session:
+    def inherit(session: Session):
         if (deceased_group := manager.find_group(deceased_name, session)) is None:
             return f"被继承群:{deceased_name} 不存在"
         if (heir_group := manager.find_group(heir_name, session)) is None:
@@ -444,9 +560,7 @@ async def _(event: Event):
         heir_group_id = heir_group.id
         item_data, stock_data = manager.bank_data(deceased_group.bank, session)
         ExRate = deceased_group.level / heir_group.level
-        imagelist = []
         if item_data:
-            imagelist.append(card_template(item_card(item_data), "继承群仓库"))
             for item, n in item_data:
                 heir_bank = session.exec(GroupBank.select_item(heir_group_id, item.id)).one_or_none()
                 if heir_bank is None:
@@ -454,113 +568,166 @@ async def _(event: Event):
                     session.add(heir_bank)
                 heir_bank.n += int(ExRate * n) if item.domain == 1 else n
         if stock_data:
-            imagelist.append(card_template(stock_card(stock_data), "继承群投资"))
             for item, n in stock_data:
                 heir_bank = session.exec(GroupBank.select_item(heir_group_id, item.id)).one_or_none()
                 if heir_bank is None:
                     heir_bank = GroupBank(bound_id=heir_group_id, item_id=item.id)
                     session.add(heir_bank)
                 heir_bank.n += n
+        if deceased_group.stock is not None:
+            candlestick_cache.discard(deceased_group.stock.id)
         deceased_group.cancel(session)
-        session.commit()
+        return item_data, stock_data
+
+    result = await manager.db.run(inherit)
+    if isinstance(result, str):
+        return result
+    item_data, stock_data = result
+    imagelist = []
+    if item_data:
+        imagelist.append(card_template(item_card(item_data), "继承群仓库"))
+    if stock_data:
+        imagelist.append(card_template(stock_card(stock_data), "继承群投资"))
     if imagelist:
         return manager.info_card(imagelist, event.user_id)
     else:
         return f"{deceased_name}已成功注销！但无任何可继承物品。"
 
 
+def stock_wealths(session: Session):
+    """
+    全部股票对应群的资产，一次查询
+        return: [(股票, 群等级, 群成员金币, 群金库金币, 群金库标准金币)]
+    """
+
+    def group_bank(item_id: str):
+        query = select(func.coalesce(func.sum(GroupBank.n), 0)).where(GroupBank.bound_id == Stock.group_id, GroupBank.item_id == item_id)
+        return query.scalar_subquery()
+
+    account_gold = (
+        select(func.coalesce(func.sum(AccountBank.n), 0))
+        .select_from(AccountBank)
+        .join(Account)
+        .where(Account.group_id == Stock.group_id, AccountBank.item_id == GOLD.id)
+        .scalar_subquery()
+    )
+    query = select(Stock, Group.level, account_gold, group_bank(GOLD.id), group_bank(STD_GOLD.id)).join(Group)
+    return session.exec(query).all()
+
+
 def stock_update():
     with manager.db.session as session:
-        stocks = session.exec(Stock.select()).all()
-        for stock in stocks:
-            wealths = manager.group_wealths(stock.group, GOLD.id, session)
-            level = stock.group.level
-            stock_value = sum(wealths) * level
-            std_bank = session.exec(GroupBank.select_item(stock.group_id, STD_GOLD.id)).one_or_none()
-            if std_bank:
-                stock_value += std_bank.n
-            stock.value = stock_value
-            floating = stock.floating
-            if math.isnan(floating):
-                stock.floating = float(stock_value)
+        if not (rows := stock_wealths(session)):
+            return
+        stocks, levels, account_gold, group_gold, group_std_gold = zip(*rows)
+        stock_value = (np.array(account_gold) + np.array(group_gold)) * np.array(levels) + np.array(group_std_gold)
+        floating = np.array([stock.floating for stock in stocks], dtype=float)
+        initialized = np.isnan(floating)
+        # 股票价格变化：趋势性影响（正态分布），随机性影响（平均分布），向债务价值回归
+        rng = np.random.default_rng()
+        floating += floating * rng.normal(0, 0.03, len(stocks))
+        floating += stock_value * rng.uniform(-0.1, 0.1, len(stocks))
+        floating += (stock_value - floating) * 0.05
+        # 结算交易市场上的股票，先结算自动出售的订单，再按订单簿结算限价卖单
+        market_orders: dict[str, list[Exchange]] = {}
+        for exchange in session.exec(Exchange.select().where(Exchange.quote <= 0)).all():
+            market_orders.setdefault(exchange.bound_id, []).append(exchange)
+        now_time = time.time()
+        records = []
+        for i, stock in enumerate(stocks):
+            stock.value = int(stock_value[i])
+            if initialized[i]:
+                stock.floating = float(stock_value[i])
                 logger.info(f"{stock.name} 已初始化")
                 continue
-            # 股票价格变化：趋势性影响（正态分布），随机性影响（平均分布），向债务价值回归
-            floating += floating * random.gauss(0, 0.03)
-            floating += stock_value * random.uniform(-0.1, 0.1)
-            floating += (stock_value - floating) * 0.05
-            # 结算交易市场上的股票
+            stock_floating = float(floating[i])
             issuance = stock.issuance
-            for exchange in sorted(stock.exchange, key=lambda x: x.quote):
-                value = 0.0
-                settle = 0
-                user = exchange.user
-                if (quote := exchange.quote) > 0:
-                    for _ in range(exchange.n):
-                        unit = floating / issuance
-                        if unit < quote:
-                            exchange.n -= settle
-                            break
-                        value += quote
-                        floating -= quote
-                        settle += 1
-                else:
-                    settle = exchange.n
-                    for _ in range(exchange.n):
-                        unit = max(floating / issuance, 0.0)
-                        value += unit
-                        floating -= unit
+            for exchange in market_orders.get(stock.id, []):
+                settle, value = settle_exchange(stock_floating, issuance, exchange.quote, exchange.n)
                 if settle == 0:
                     continue
+                stock_floating -= value
+                user_id = exchange.user_id
                 exchange.deal(settle, session)
-                bank = user.item(stock.id, session).one_or_none()
-                value = int(value)
-                bank = user.item(STD_GOLD.id, session).one_or_none()
-                if bank is None:
-                    bank = UserBank(bound_id=user.id, item_id=STD_GOLD.id, n=value)
-                    session.add(bank)
-                else:
-                    bank.n += value
-                stock.floating = floating
-            # 记录价格历史
-            now_time = time.time()
-            if not (record := stock.extra.get("record")):
-                record = [(0.0, 0.0) for _ in range(720)]
-            record.append((now_time, floating / issuance))
-            record = record[-720:]
-            stock.extra["record"] = record
+                STD_GOLD.bank_deal(session.bank(UserBank, user_id, STD_GOLD.id), int(value), session)
+            for _, _, order_id in book.iter_asks(stock.id):
+                if (exchange := session.get(Exchange, order_id)) is None:
+                    continue
+                n = exchange.n
+                settle, value = settle_exchange(stock_floating, issuance, exchange.quote, n)
+                if settle == 0:
+                    break
+                stock_floating -= value
+                user_id = exchange.user_id
+                exchange.deal(settle, session)
+                STD_GOLD.bank_deal(session.bank(UserBank, user_id, STD_GOLD.id), int(value), session)
+                # 部分成交说明股价已低于该报价，更高的报价也不会成交
+                if settle < n:
+                    break
+            stock.floating = stock_floating
+            records.append({"stock_id": stock.id, "time": now_time, "price": stock_floating / issuance})
             logger.info(f"{stock.name} 更新成功！")
-        session.commit()
+        # 记录价格历史，清理过期记录
+        if records:
+            session.execute(insert(StockRecord), records)
+        session.execute(delete(StockRecord).where(StockRecord.time < now_time - record_retention))
+    for record in records:
+        candlestick_cache.record(record["stock_id"], now_time, record["price"])
 
 
 @plugin.handle(["刷新市场"], ["permission"], rule=Rule.superuser)
 async def _(event: Event):
-    stock_update()
+    await asyncio.to_thread(stock_update)
+
+
+def reset_revolution(session: Session):
+    """周五至周日刷新重置签到"""
+    if datetime.today().weekday() in {4, 5, 6}:
+        query = update(Account).where(col(Account.revolution) == False).values(revolution=True)
+        session.execute(query.execution_options(synchronize_session=False))
+
+
+def reconcile_issuance(session: Session):
+    """股票发行量 = 20000 * 群等级，差额由群仓库补齐"""
+    level = select(Group.level).where(Group.id == Stock.group_id).scalar_subquery()
+    session.execute(update(Stock).values(issuance=20000 * level).execution_options(synchronize_session=False))
+    session.execute(
+        sqlite_insert(GroupBank)
+        .from_select(["bound_id", "item_id", "n"], select(Stock.group_id, Stock.id, literal(0)).where(true()))
+        .on_conflict_do_nothing()
+    )
+    held = select(func.coalesce(func.sum(UserBank.n), 0)).where(UserBank.item_id == Stock.id).scalar_subquery()
+    query = (
+        select(Stock.name, Stock.issuance, GroupBank.id, GroupBank.n + held)
+        .join(GroupBank, and_(col(GroupBank.bound_id) == Stock.group_id, col(GroupBank.item_id) == Stock.id))
+        .where(GroupBank.n + held != Stock.issuance)
+    )
+    difference = []
+    for name, issuance, bank_id, actually_issuance in session.exec(query).all():
+        logger.warning(f"{name} 发行量错误,正在尝试修复。")
+        difference.append({"bank_id": bank_id, "difference": issuance - actually_issuance})
+    if difference:
+        session.connection().execute(
+            update(GroupBank).where(col(GroupBank.id) == bindparam("bank_id")).values(n=col(GroupBank.n) + bindparam("difference")),
+            difference,
+        )
+
+
+new_day_steps = {
+    "重置签到": reset_revolution,
+    "股票发行量": reconcile_issuance,
+}
+"""每日维护步骤，每步一个事务"""
 
 
 def new_day():
-    with manager.db.session as session:
-        revolution_today = datetime.today().weekday() in {4, 5, 6}
-        if revolution_today:
-            accounts = session.exec(Account.select()).all()
-            for account in accounts:
-                account.extra["revolution"] = revolution_today
-        for group in session.exec(Group.select()).all():
-            query = AccountBank.select().where(AccountBank.bound_id == group.id, AccountBank.item_id == REVOLUTION_MARKING.id)
-            banks = session.exec(query).all()
-            group.level = 1 + sum(bank.n for bank in banks)
-        for stock in session.exec(Stock.select()).all():
-            group_bank = stock.group.item(stock.id, session).one_or_none()
-            if group_bank is None:
-                group_bank = UserBank(bound_id=stock.group.id, item_id=stock.id)
-                session.add(group_bank)
-            banks = session.exec(UserBank.select().where(UserBank.item_id == stock.id))
-            actually_issueance = sum(bank.n for bank in banks) + group_bank.n
-            stock.issuance = 20000 * stock.group.level
-            if actually_issueance != stock.issuance:
-                logger.warning(f"{stock.name} 发行量错误,正在尝试修复。")
-            difference = stock.issuance - actually_issueance
-            group_bank.n += difference
+    timings: list[str] = []
+    for name, step in new_day_steps.items():
+        start = time.perf_counter()
+        with manager.db.session as session:
+            step(session)
+        timings.append(f"{name} {time.perf_counter() - start:.3f}s")
+    logger.info(f"市场每日维护：{", ".join(timings)}")
 
 
 scheduler.add_job(stock_update, trigger="cron", minute="*/5", misfire_grace_time=120)
@@ -12,3 +12,5 @@ class Config(BaseModel):
     revolt_gold: tuple[int, int] = (1000, 2000)
     # 注册公司金币数
     company_public_gold: int = 20000
+    # 股价记录保留时间（秒）
+    record_retention: int = 216000
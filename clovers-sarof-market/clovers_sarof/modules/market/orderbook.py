@@ -0,0 +1,113 @@
+import heapq
+import threading
+from collections.abc import Iterator
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from clovers_sarof.core.account import Session, Exchange
+
+type Order = tuple[float, float, int]
+"""卖单 (报价, 挂单时间戳, id)"""
+
+
+class OrderBook:
+    """
+    内存订单簿
+
+    每支股票的限价卖单按报价、挂单时间排成小根堆。
+    Exchange 表的增删改在 flush 时暂存到会话中，提交后才写入订单簿，回滚则丢弃。
+    订单簿里的订单只作索引，使用前需要从数据库取出对应的 Exchange 核对。
+    """
+
+    def __init__(self) -> None:
+        self.asks: dict[str, list[Order]] = {}
+        """股票 id -> 卖单堆，堆中可能有已失效的订单"""
+        self.orders: dict[int, Order] = {}
+        """订单 id -> 当前有效的订单"""
+        self.live: dict[str, int] = {}
+        """股票 id -> 有效卖单数量"""
+        self.loaded = False
+        self.lock = threading.Lock()
+        event.listen(Exchange, "after_insert", self.stage)
+        event.listen(Exchange, "after_update", self.stage)
+        event.listen(Exchange, "after_delete", self.stage_delete)
+        event.listen(Session, "after_commit", self.apply)
+        event.listen(Session, "after_soft_rollback", self.discard)
+
+    @staticmethod
+    def order(exchange: Exchange) -> Order | None:
+        if exchange.quote > 0 and exchange.n > 0:
+            return (exchange.quote, exchange.time.timestamp(), exchange.id)  # type: ignore
+
+    def stage(self, mapper, connection, target: Exchange):
+        if (session := object_session(target)) is not None:
+            session.info.setdefault("orderbook", []).append((target.bound_id, target.id, self.order(target)))
+
+    def stage_delete(self, mapper, connection, target: Exchange):
+        if (session := object_session(target)) is not None:
+            session.info.setdefault("orderbook", []).append((target.bound_id, target.id, None))
+
+    def apply(self, session: Session):
+        if not (staged := session.info.pop("orderbook", None)) or not self.loaded:
+            return
+        with self.lock:
+            for stock_id, order_id, order in staged:
+                if self.orders.pop(order_id, None) is not None:
+                    self.live[stock_id] -= 1
+                if order is not None:
+                    self.orders[order_id] = order
+                    self.live[stock_id] = self.live.get(stock_id, 0) + 1
+                    heapq.heappush(self.asks.setdefault(stock_id, []), order)
+                self.compact(stock_id)
+
+    def discard(self, session: Session, previous_transaction):
+        session.info.pop("orderbook", None)
+
+    def compact(self, stock_id: str):
+        """失效订单超过一半时重建卖单堆"""
+        heap = self.asks.get(stock_id)
+        if not heap or len(heap) <= 2 * self.live.get(stock_id, 0) + 16:
+            return
+        valid = [order for order in heap if self.orders.get(order[2]) == order]
+        heapq.heapify(valid)
+        self.asks[stock_id] = valid
+
+    def load(self, session: Session):
+        """首次使用时从数据库加载全部限价卖单"""
+        if self.loaded:
+            return
+        query = Exchange.select().where(Exchange.quote > 0, Exchange.n > 0)
+        exchanges = session.exec(query).all()
+        with self.lock:
+            if self.loaded:
+                return
+            for exchange in exchanges:
+                order = self.order(exchange)
+                assert order is not None
+                self.orders[order[2]] = order
+                self.live[exchange.bound_id] = self.live.get(exchange.bound_id, 0) + 1
+                self.asks.setdefault(exchange.bound_id, []).append(order)
+            for heap in self.asks.values():
+                heapq.heapify(heap)
+            self.loaded = True
+
+    def iter_asks(self, stock_id: str) -> Iterator[Order]:
+        """按价格、时间优先的顺序遍历有效卖单，不修改订单簿"""
+        with self.lock:
+            heap = list(self.asks.get(stock_id, ()))
+        if not heap:
+            return
+        frontier = [(heap[0], 0)]
+        while frontier:
+            order, i = heapq.heappop(frontier)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            if self.orders.get(order[2]) == order:
+                yield order
+
+    def clear(self):
+        with self.lock:
+            self.asks.clear()
+            self.orders.clear()
+            self.live.clear()
+            self.loaded = False
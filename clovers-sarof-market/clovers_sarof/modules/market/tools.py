@@ -1,19 +1,83 @@
+import math
 import numpy as np
 
 
-def gini_coef(wealths: list[int]) -> float:
+def gini_coef(wealths: np.ndarray) -> float:
     """
     计算基尼系数
+        wealths: 升序排列的财富
     """
-    wealths.sort()
-    wealths.insert(0, 0)
-    wealths_cum = np.cumsum(wealths)
-    wealths_sum = wealths_cum[-1]
-    N = len(wealths_cum)
-    S = np.trapezoid(wealths_cum / wealths_sum, np.array(range(N)) / (N - 1))
+    wealths_cum = np.concatenate(([0.0], np.cumsum(wealths, dtype=np.float64)))
+    S = np.trapezoid(wealths_cum / wealths_cum[-1], dx=1 / (len(wealths_cum) - 1))
     return 1 - 2 * S
 
 
+def settle_exchange(floating: float, issuance: int, quote: float, n: int) -> tuple[int, float]:
+    """
+    结算一条卖单，每卖出一股浮动资产减少成交价
+        floating: 浮动资产
+        issuance: 股票发行量
+        quote: 报价，报价为 0 时按当前股价卖出
+        n: 挂单数量
+        return: 成交数量, 成交金额
+    """
+    if quote > 0:
+        # 第 i 股成交条件 (floating - i * quote) / issuance >= quote
+        if floating < quote * issuance:
+            return 0, 0.0
+        settle = min(n, int((floating - quote * issuance) // quote) + 1)
+        return settle, settle * quote
+    if floating <= 0:
+        return n, 0.0
+    # 每股按 floating / issuance 成交，n 股后剩余 floating * (1 - 1 / issuance) ** n
+    return n, floating * (1 - (1 - 1 / issuance) ** n)
+
+
+def purchase_plan(
+    value: float,
+    floating: float,
+    issuance: int,
+    count: int,
+    quote: float,
+    budget: float,
+) -> tuple[int, float]:
+    """
+    计算购买数量和总价
+        每买入一股全群资产增加成交价，股价为 max(全群资产, 浮动资产) / 发行量
+        value: 全群资产
+        floating: 浮动资产
+        issuance: 股票发行量
+        count: 最大购买数量（已包含群库存限制）
+        quote: 最高单价，为 0 时不限价
+        budget: 可用预算
+        return: 购买数量, 总价
+    """
+    rate = 1 + 1 / issuance
+    # 全群资产低于浮动资产时股价恒为 floating / issuance，前 m 股按此价格成交
+    m = math.ceil((floating - value) * issuance / floating) if value < floating else 0
+
+    def value_after(k: int) -> float:
+        """买入 k 股后的全群资产"""
+        if k <= m:
+            return value + k * floating / issuance
+        return (value + m * floating / issuance) * rate ** (k - m)
+
+    def affordable(k: int) -> bool:
+        """能否买入 k 股：第 k 股单价不超过报价，总价不超过预算"""
+        if quote > 0 and max(value_after(k - 1), floating) / issuance > quote:
+            return False
+        return value_after(k) - value <= budget
+
+    low, high = 0, max(count, 0)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if affordable(mid):
+            low = mid
+        else:
+            high = mid - 1
+    return low, value_after(low) - value
+
+
 def integer_log(number, base) -> int:
     return int(np.log(number) / np.log(base))
 
@@ -0,0 +1,154 @@
+import threading
+import numpy as np
+from sqlmodel import select, col
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from clovers_sarof.core.account import Session, Account, AccountBank
+from .tools import gini_coef
+
+
+class GroupWealth:
+    """群内账户的某种道具库存，按数量升序，数量相同时账户 id 大的在前"""
+
+    def __init__(self, account_ids: np.ndarray, wealths: np.ndarray) -> None:
+        order = np.lexsort((-account_ids, wealths))
+        self.account_ids = account_ids[order]
+        self.wealths = wealths[order]
+
+    def above(self, threshold: int):
+        """数量大于 threshold 的部分"""
+        start = np.searchsorted(self.wealths, threshold, side="right")
+        return self.account_ids[start:], self.wealths[start:]
+
+    def stats(self, threshold: int = 0):
+        """
+        财富统计
+            return: (人数, 总数, 基尼系数)
+        """
+        _, wealths = self.above(threshold)
+        total = int(wealths.sum())
+        return len(wealths), total, gini_coef(wealths) if total > 0 else 0.0
+
+    def top(self, k: int, threshold: int = 0):
+        """
+        前 k 名
+            return: [(账户 id, 数量)]，按数量降序
+        """
+        account_ids, wealths = self.above(threshold)
+        return list(zip(account_ids[::-1][:k].tolist(), wealths[::-1][:k].tolist()))
+
+
+class WealthStats:
+    """
+    各群财富统计
+
+    一次投影查询取出账户库存到 NumPy 数组，按群缓存排序结果。
+    AccountBank 中该道具的增删改（包括 Session.grant 的批量写入）在提交后使所在群的缓存失效，回滚则丢弃。
+    其他绕过 ORM 的批量语句需要手动调用 invalidate。
+    """
+
+    def __init__(self, item_id: str) -> None:
+        self.item_id = item_id
+        self.groups: dict[str, GroupWealth] = {}
+        """群 id -> 缓存的财富统计"""
+        self.account_group: dict[int, str] = {}
+        """账户 id -> 群 id"""
+        self.lock = threading.Lock()
+        event.listen(AccountBank, "after_insert", self.stage)
+        event.listen(AccountBank, "after_update", self.stage)
+        event.listen(AccountBank, "after_delete", self.stage)
+        event.listen(Session, "before_commit", self.stage_grants)
+        event.listen(Session, "after_commit", self.apply)
+        event.listen(Session, "after_soft_rollback", self.discard)
+
+    def stage(self, mapper, connection, target: AccountBank):
+        if target.item_id != self.item_id or (session := object_session(target)) is None:
+            return
+        if (group_id := self.group_of(connection, target.bound_id)) is not None:
+            session.info.setdefault("wealth_stats", set()).add(group_id)
+
+    def stage_grants(self, session: Session):
+        """Session.grant 批量写入的库存"""
+        grants = session.info.get("grants", ())
+        staged = [bound_id for BankType, bound_id, item_ids in grants if BankType is AccountBank and self.item_id in item_ids]
+        if not staged:
+            return
+        connection = session.connection()
+        group_ids = {group_id for bound_id in staged if (group_id := self.group_of(connection, bound_id)) is not None}
+        session.info.setdefault("wealth_stats", set()).update(group_ids)
+
+    def group_of(self, connection, account_id: int):
+        if (group_id := self.account_group.get(account_id)) is None:
+            group_id = connection.execute(select(Account.group_id).where(Account.id == account_id)).scalar()
+            if group_id is not None:
+                self.account_group[account_id] = group_id
+        return group_id
+
+    def apply(self, session: Session):
+        if staged := session.info.pop("wealth_stats", None):
+            self.invalidate(*staged)
+
+    def discard(self, session: Session, previous_transaction):
+        session.info.pop("wealth_stats", None)
+
+    def invalidate(self, *group_ids: str):
+        """使缓存失效，不指定群时清空全部缓存"""
+        with self.lock:
+            if not group_ids:
+                self.groups.clear()
+                return
+            for group_id in group_ids:
+                self.groups.pop(group_id, None)
+
+    def clear(self):
+        """清空全部缓存和账户所在群的记录，数据回档后调用"""
+        with self.lock:
+            self.groups.clear()
+            self.account_group.clear()
+
+    def load(self, session: Session, group_ids: list[str] | None = None):
+        """
+        加载群财富统计
+            group_ids: 为 None 时加载全部群
+        """
+        with self.lock:
+            cached = dict(self.groups)
+        if group_ids is None:
+            missing = None
+        elif not (missing := [group_id for group_id in group_ids if group_id not in cached]):
+            return {group_id: cached[group_id] for group_id in group_ids}
+        query = (
+            select(Account.group_id, AccountBank.bound_id, AccountBank.n)
+            .join(Account, col(AccountBank.bound_id) == Account.id)
+            .where(AccountBank.item_id == self.item_id)
+        )
+        if missing is not None:
+            query = query.where(col(Account.group_id).in_(missing))
+        rows = session.exec(query).all()
+        loaded: dict[str, GroupWealth] = {}
+        if rows:
+            group_column, account_ids, wealths = zip(*rows)
+            group_column = np.array(group_column)
+            account_ids = np.array(account_ids, dtype=np.int64)
+            wealths = np.array(wealths, dtype=np.int64)
+            order = np.argsort(group_column, kind="stable")
+            group_column, account_ids, wealths = group_column[order], account_ids[order], wealths[order]
+            keys, starts = np.unique(group_column, return_index=True)
+            ends = [*starts[1:], len(group_column)]
+            for group_id, start, end in zip(keys.tolist(), starts, ends):
+                loaded[group_id] = GroupWealth(account_ids[start:end], wealths[start:end])
+                self.account_group.update(dict.fromkeys(account_ids[start:end].tolist(), group_id))
+        empty = GroupWealth(np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        for group_id in missing or ():
+            loaded.setdefault(group_id, empty)
+        with self.lock:
+            if missing is None:
+                self.groups = loaded
+            else:
+                self.groups.update(loaded)
+        if group_ids is None:
+            return loaded
+        return {group_id: cached.get(group_id) or loaded[group_id] for group_id in group_ids}
+
+    def group(self, group_id: str, session: Session):
+        return self.load(session, [group_id])[group_id]
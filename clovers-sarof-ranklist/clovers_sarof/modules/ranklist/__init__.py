@@ -1,13 +1,14 @@
 import asyncio
 from clovers_sarof.core import __plugin__ as plugin, Event
-from clovers_sarof.core import manager, client
+from clovers_sarof.core import manager, avatars
 from clovers_sarof.core import REVOLUTION_MARKING
-from clovers_sarof.core.tools import download_url
+from clovers_sarof.core.render import render
+from clovers_sarof.core.account import Session
 from .image import draw_rank
-from .rankdata import rank_account_bank, rank_user_bank, rank_user_extra
+from .rankdata import rank_account_bank, rank_user_bank, rank_user_stats
 
 
-user_extra = {
+user_stats = {
     "胜场": "win",
     "败场": "lose",
     "连胜": "win_streak",
@@ -17,7 +18,7 @@ user_extra = {
 }
 
 
-def ranklist(title: str, group_id: str | None = None, limit: int = 20):
+def ranklist(session: Session, title: str, group_id: str | None = None, limit: int = 20):
     if title in ("路灯挂件", "重置"):
         key = REVOLUTION_MARKING.id
         func = rank_account_bank
@@ -31,12 +32,11 @@ def ranklist(title: str, group_id: str | None = None, limit: int = 20):
         else:
             return
     else:
-        key = user_extra.get(title)
+        key = user_stats.get(title)
         if key is None:
             return
-        func = rank_user_extra
-    with manager.db.session as session:
-        return func(key, group_id, limit, session)
+        func = rank_user_stats
+    return func(key, group_id, limit, session)
 
 
 @plugin.handle(r"^(.+)排行(.*)", ["user_id", "group_id", "to_me"])
@@ -47,9 +47,10 @@ async def _(event: Event):
         title = title[:-1]
     else:
         group_id = event.group_id
-    data = ranklist(title, group_id)
+    data = await manager.db.run(ranklist, title, group_id)
     if not data:
         return f"无数据，无法进行{title}排行" if event.to_me else None
     avatar_urls, nicknames, values = zip(*data)
-    avatar_data = await asyncio.gather(*(download_url(url, client) for url in avatar_urls))
-    return manager.info_card([draw_rank(list(zip(avatar_data, nicknames, values)))], event.user_id)
+    avatar_data = await asyncio.gather(*(avatars.get(url) for url in avatar_urls))
+    rank_image = await render(draw_rank, list(zip(avatar_data, nicknames, values)))
+    return manager.info_card([rank_image], event.user_id)
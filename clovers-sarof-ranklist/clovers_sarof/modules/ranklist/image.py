@@ -1,6 +1,5 @@
-from io import BytesIO
 from PIL import Image, ImageDraw
-from clovers_sarof.core.linecard import FONT_DEFAULT, CIRCLE_60_MASK
+from clovers_sarof.core.linecard import FONT_DEFAULT, avatar_thumbnail
 from clovers_sarof.core.tools import format_number
 
 
@@ -13,8 +12,7 @@ def draw_rank(data: list[tuple[bytes | None, str, int]], fill="#FFFFFFAA"):
     draw = ImageDraw.Draw(canvas)
     y = 20
     for i, (avatar, nickname, v) in enumerate(data, start=1):
-        if avatar:
-            (avatar_image := Image.open(BytesIO(avatar)).resize((60, 60))).putalpha(CIRCLE_60_MASK)
+        if (avatar_image := avatar_thumbnail(avatar, 60)) is not None:
             canvas.paste(avatar_image, (5, y))
         draw.rectangle(((70, y + 10), (70 + int(v / first * 790), y + 50)), fill=fill)
         draw.text((80, y + 10), f"{i}.{nickname} {format_number(v)}", fill=(0, 0, 0), font=FONT_DEFAULT)
@@ -1,31 +1,40 @@
 import typing
-from sqlmodel import func, cast, Integer, desc, select, Column
-from clovers_sarof.core.account import AccountBank, UserBank, Group, User, Account, Session
+from sqlmodel import desc, select, Column
+from clovers_sarof.core.account import AccountBank, UserBank, User, UserStats, UserWealth, Account, Session
 
 
-def _rank_user_extra_all(key: str, limit: int, session: Session):
-    value = cast(func.json_extract(User.extra, f"$.{key}"), Integer)
-    query = select(User.avatar_url, User.name, value).where(value.isnot(None)).order_by(value.desc()).limit(limit)
+def _rank_user_stats_all(key: str, limit: int, session: Session):
+    value = getattr(UserStats, key)
+    query = (
+        select(User.avatar_url, User.name, value)
+        .select_from(UserStats)
+        .join(User, typing.cast(Column, UserStats.user_id) == User.id)
+        .where(value > 0)
+        .order_by(value.desc())
+        .limit(limit)
+    )
     return session.exec(query).all()
 
 
-def _rank_user_extra_group(key: str, group_id: str, limit: int, session: Session):
-    value = cast(func.json_extract(User.extra, f"$.{key}"), Integer)
+def _rank_user_stats_group(key: str, group_id: str, limit: int, session: Session):
+    value = getattr(UserStats, key)
     query = (
         select(User.avatar_url, Account.name, value)
-        .join(User, typing.cast(Column, Account.user_id) == User.id)  # FROM Account
-        .where(Account.group_id == group_id, value.isnot(None))
+        .select_from(UserStats)
+        .join(User, typing.cast(Column, UserStats.user_id) == User.id)
+        .join(Account, typing.cast(Column, User.id) == Account.user_id)
+        .where(Account.group_id == group_id, value > 0)
         .order_by(value.desc())
         .limit(limit)
     )
     return session.exec(query).all()
 
 
-def rank_user_extra(key: str, group_id: str | None, limit: int, session: Session):
+def rank_user_stats(key: str, group_id: str | None, limit: int, session: Session):
     if group_id is None:
-        return _rank_user_extra_all(key, limit, session)
+        return _rank_user_stats_all(key, limit, session)
     else:
-        return _rank_user_extra_group(key, group_id, limit, session)
+        return _rank_user_stats_group(key, group_id, limit, session)
 
 
 def _rank_user_bank_all(item_id: str, limit: int, session: Session):
@@ -61,13 +70,11 @@ def rank_user_bank(item_id: str, group_id: str | None, limit: int, session: Sess
 
 def _get_account_bank_all(item_id: str, limit: int, session: Session):
     query = (
-        select(User.avatar_url, User.name, func.sum(AccountBank.n * Group.level).label("total_value"))
-        .join(Account, typing.cast(Column, AccountBank.bound_id) == Account.id)  # FROM AccountBank
-        .join(User, typing.cast(Column, Account.user_id) == User.id)
-        .join(Group, typing.cast(Column, Account.group_id) == Group.id)
-        .where(AccountBank.item_id == item_id)
-        .group_by(User.id, User.avatar_url, User.name)
-        .order_by(desc("total_value"))
+        select(User.avatar_url, User.name, UserWealth.value)
+        .select_from(UserWealth)
+        .join(User, typing.cast(Column, UserWealth.user_id) == User.id)
+        .where(UserWealth.item_id == item_id, UserWealth.value > 0)
+        .order_by(desc(UserWealth.value))
         .limit(limit)
     )
     return session.exec(query).all()
@@ -1,11 +1,21 @@
 from ._clovers import create_plugin, Event, Rule
 from ._manager import Manager
 from ._config import __config__
+from .tools import AvatarCache
+from . import render
 import httpx
 
 __plugin__ = create_plugin()
 """主插件实例"""
-manager = Manager(__config__.path)
+manager = Manager(
+    __config__.path,
+    __config__.sqlite_pragmas,
+    __config__.sqlite_pool_size,
+    __config__.backup_pages,
+    __config__.backup_sleep,
+    __config__.backup_zstd,
+    __config__.background_cache,
+)
 """小游戏管理器实例"""
 
 
@@ -17,6 +27,10 @@ DEBUG_MARKING = manager.items_library["Debug奖章"]
 
 client = httpx.AsyncClient()
 __plugin__.shutdown(client.aclose)
+avatars = AvatarCache(manager.path / "avatar", client, ttl=__config__.avatar_ttl)
+"""头像缓存"""
+__plugin__.shutdown(manager.db.close)
+__plugin__.shutdown(render.executor.shutdown)
 
 __all__ = [
     "Event",
@@ -24,6 +38,7 @@ __all__ = [
     "__plugin__",
     "manager",
     "client",
+    "avatars",
     "GOLD",
     "STD_GOLD",
     "REVOLUTION_MARKING",
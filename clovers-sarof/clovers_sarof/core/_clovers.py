@@ -1,11 +1,37 @@
+import asyncio
 from io import BytesIO
 from typing import Any, Protocol
 from collections.abc import AsyncGenerator
+from concurrent.futures import Future
 from clovers import EventProtocol, Event as BaseEvent, Result, Plugin
 from .tools import to_int
 
 
+def pending(result) -> bool:
+    """结果中是否有未完成的 Future"""
+    if isinstance(result, (Future, asyncio.Future)):
+        return True
+    if isinstance(result, list):
+        return any(pending(seg) for seg in result)
+    return False
+
+
+async def resolve(result):
+    """等待结果中的 Future 完成"""
+    if isinstance(result, (Future, asyncio.Future)):
+        return await resolve(await asyncio.wrap_future(result))
+    if isinstance(result, list):
+        return [await resolve(seg) for seg in result]
+    return result
+
+
 def build_result(result):
+    if pending(result):
+
+        async def pending_output():
+            yield build_result(await resolve(result))
+
+        return Result("segmented", pending_output())
     if isinstance(result, str):
         return Result("text", result)
     if isinstance(result, BytesIO):
@@ -16,7 +42,7 @@ def build_result(result):
 
         async def output():
             async for x in result:
-                yield build_result(x)
+                yield build_result(await resolve(x))
 
         return Result("segmented", output())
     return result
@@ -13,6 +13,26 @@ class Config(BaseModel):
         "msyh",
         "seguiemj",
     ]
+    # 数据库 PRAGMA 设置，每个新连接都会执行
+    sqlite_pragmas: dict[str, str | int] = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "busy_timeout": 5000,
+    }
+    # 数据库连接池大小（读连接数 + 1 个写连接）
+    sqlite_pool_size: int = 4
+    # 在线备份每步复制的页面数
+    backup_pages: int = 256
+    # 在线备份每步之间的间隔（秒）
+    backup_sleep: float = 0.01
+    # 备份文件是否使用 zstd 压缩（需要安装 zstandard）
+    backup_zstd: bool = False
+    # 背景图层缓存大小（MB）
+    background_cache: int = 128
+    # 头像缓存重新验证的间隔（秒）
+    avatar_ttl: int = 3600
 
 
 from clovers.config import Config as CloversConfig
@@ -10,13 +10,21 @@ import shutil
 from io import BytesIO
 from pathlib import Path
 from datetime import datetime
-from collections.abc import Sequence
+from collections.abc import Callable, Sequence
+from sqlmodel import select, update, delete, func, col, or_, and_
 from PIL import ImageFilter, Image
 from PIL.Image import Image as IMG
-from linecard import info_splicing, ImageList, CanvasEffectHandler
+from linecard import info_splicing, CropResize, ImageList, CanvasEffectHandler
 from ._clovers import Event
-from .account import Session, DataBase, Group, Account, AccountBank, BaseBank, Stock, Item
-from .tools import Library
+from .account import Session, DataBase, Group, Account, AccountBank, UserBank, BaseBank, Stock, Item
+from .tools import Library, LRUCache
+from .migration import upgrade
+from .render import submit
+from . import backup as sqlite_backup
+
+
+card_layout = {"width": 880, "padding": 20, "spacing": 10}
+"""信息卡片布局，info_splicing 和缓存背景图层使用同一组参数"""
 
 
 def canvas_effect(canvas: IMG, image: IMG, padding: int, x: int, y: int):
@@ -39,47 +47,258 @@ def canvas_effect(canvas: IMG, image: IMG, padding: int, x: int, y: int):
     canvas.paste(image, (padding, y), mask=image)
 
 
+def blur_layer(canvas: IMG):
+    """canvas_effect 使用的模糊背景图层"""
+    return canvas.filter(ImageFilter.BLUR).filter(ImageFilter.GaussianBlur(radius=8))
+
+
+def layer_effect(layer: IMG) -> CanvasEffectHandler:
+    """
+    使用预先模糊的背景图层的 canvas_effect
+        模糊和半透明蒙版可以交换顺序，所以先整体模糊背景，再逐块叠加蒙版。
+    """
+
+    def effect(canvas: IMG, image: IMG, padding: int, x: int, y: int):
+        height = image.size[1]
+        shadow = Image.new("RGBA", (x, height), "#0000000F")
+        canvas.paste(shadow, (padding + 4, y + 4), mask=shadow)
+        box = (padding, y, x + padding, y + height)
+        region = layer.crop(box)
+        mask = Image.new("RGBA", (x, height), "#00000022")
+        mask.paste((255, 255, 255, 0x22), (4, 4, x - 4, height - 4))
+        region.paste(mask, mask=mask)
+        canvas.paste(region, box)
+        canvas.paste(image, (padding, y), mask=image)
+
+    return effect
+
+
+def image_weight(image: IMG):
+    return image.width * image.height * len(image.getbands())
+
+
+class BackgroundCache:
+    """
+    背景图层缓存
+        缓存解码后的背景图片，以及按卡片尺寸裁剪、模糊好的背景图层。
+        缓存键包含文件的修改时间，替换背景图片后旧缓存自然失效。
+    """
+
+    def __init__(self, path: Path, maxweight: int) -> None:
+        self.path = path
+        self.cache = LRUCache[tuple, IMG](maxweight=maxweight, weigh=image_weight)
+
+    def source(self, user_id: str):
+        """
+        用户的背景图片
+            return: (文件名, 修改时间)，没有背景图片时返回 None
+        """
+        for name in (user_id, "default"):
+            try:
+                return name, self.path.joinpath(f"{name}.png").stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+    def image(self, name: str, mtime: int):
+        key = (name, mtime)
+        if (image := self.cache.get(key)) is None:
+            image = Image.open(self.path / f"{name}.png").convert("RGB")
+            self.cache.set(key, image)
+        return image
+
+    def layer(self, user_id: str, size: tuple[int, int], blur: bool = False):
+        """
+        裁剪到卡片尺寸的背景图层
+            blur: 返回模糊后的图层
+            return: 缓存中的图层，修改前需要复制；没有背景图片时返回 None
+        """
+        if (source := self.source(user_id)) is None:
+            return None
+        key = (*source, size, blur)
+        if (layer := self.cache.get(key)) is None:
+            if blur:
+                layer = blur_layer(self.layer(user_id, size))
+            else:
+                layer = CropResize(self.image(*source), size)
+            self.cache.set(key, layer)
+        return layer
+
+    def discard(self, user_id: str):
+        self.cache.evict(lambda key: key[0] == user_id)
+
+
 class Manager:
-    def __init__(self, path: str | Path) -> None:
+    def __init__(
+        self,
+        path: str | Path,
+        pragmas: dict[str, str | int] | None = None,
+        pool_size: int = 4,
+        backup_pages: int = 256,
+        backup_sleep: float = 0.01,
+        backup_zstd: bool = False,
+        background_cache: int = 128,
+    ) -> None:
         self.path = Path(path) if isinstance(path, str) else path
         self.BG_PATH = self.path / "BG_image"
         self.BG_PATH.mkdir(exist_ok=True, parents=True)
+        self.background = BackgroundCache(self.BG_PATH, background_cache << 20)
+        """背景图层缓存"""
         self.backup_path = self.path / "backup"
         self.backup_path.mkdir(exist_ok=True, parents=True)
+        self.backup_pages = backup_pages
+        """在线备份每步复制的页面数"""
+        self.backup_sleep = backup_sleep
+        """在线备份每步之间的间隔（秒）"""
+        self.backup_zstd = backup_zstd
+        """备份文件是否使用 zstd 压缩"""
         self.sqlite_db = self.path.joinpath("clovers_game_collection.db")
-        self.db = DataBase(f"sqlite:///{self.sqlite_db.as_posix()}")
+        self.db = DataBase(f"sqlite:///{self.sqlite_db.as_posix()}", pragmas, pool_size)
+        upgrade(self.db.engine)
         self.items_library = Library[str, Item]()
         for k, v in json.loads(Path(__file__).parent.joinpath("props_library.json").read_text(encoding="utf_8")).items():
             item = Item(f"item:{k}", **v)
             self.items_library.set_library(item.id, {item.name}, item)
         self.marking_library = Library[str, Item]()
+        self.restore_hooks: list[Callable[[], None]] = []
+        """回档后依次执行，用于重建内存中的缓存"""
+
+    def on_restore(self, func: Callable[[], None]):
+        """注册回档后执行的函数，在数据库线程中调用"""
+        self.restore_hooks.append(func)
+        return func
 
     def backup(self):
+        """
+        在线备份数据库
+            当天第一次备份为完整快照，之后为相对当天完整快照的差异快照
+        """
         date_today, now_time = datetime.now().strftime("%Y-%m-%d %H-%M-%S").split()
         backup_today = self.backup_path / date_today
-        if not backup_today.exists():
-            backup_today.mkdir(mode=755)
-        file = backup_today / f"clovers_game_collection {now_time}.db"
-        shutil.copy2(self.sqlite_db, file)
+        backup_today.mkdir(exist_ok=True)
+        suffix = ".zst" if self.backup_zstd else ""
+        snapshot = backup_today / f"clovers_game_collection {now_time}.tmp"
+        try:
+            sqlite_backup.online_backup(self.sqlite_db, snapshot, self.backup_pages, self.backup_sleep)
+            bases = sorted(f for f in backup_today.iterdir() if sqlite_backup.is_snapshot(f))
+            if bases:
+                file = backup_today / f"clovers_game_collection {now_time}.diff{suffix}"
+                sqlite_backup.save_diff(bases[-1], snapshot, file)
+            else:
+                file = backup_today / f"clovers_game_collection {now_time}.db{suffix}"
+                sqlite_backup.save_snapshot(snapshot, file)
+        finally:
+            snapshot.unlink(missing_ok=True)
+        return file
+
+    def backups(self):
+        """
+        全部备份文件
+            return: {日期: {时间: 备份文件}}
+        """
+        result: dict[str, dict[str, Path]] = {}
+        for folder in sorted(f for f in self.backup_path.iterdir() if f.is_dir()):
+            files = {f.name.split()[1].split(".")[0]: f for f in folder.iterdir() if sqlite_backup.is_snapshot(f) or ".diff" in f.suffixes}
+            if files:
+                result[folder.name] = dict(sorted(files.items()))
+        return result
+
+    def restore(self, file: Path):
+        """
+        从备份文件回档
+            回档前会先备份当前数据库
+        """
+        self.backup()
+        target = file.with_name(f"{file.name.split(".")[0]}.restore")
+        try:
+            sqlite_backup.rebuild(file, target)
+            sqlite_backup.online_restore(target, self.sqlite_db)
+        finally:
+            target.unlink(missing_ok=True)
+        self.db.engine.dispose()
+        self.db.account_ids.clear()
+        upgrade(self.db.engine)
+        for hook in self.restore_hooks:
+            hook()
 
     def clean_backup(self, delta: int | float):
         folders = [f for f in self.backup_path.iterdir() if f.is_dir()]
         info = []
         timestamp = datetime.now().timestamp()
         for folder in folders:
-            if timestamp - folder.stat().st_birthtime > delta:
+            try:
+                created = datetime.strptime(folder.name, "%Y-%m-%d").timestamp()
+            except ValueError:
+                continue
+            if timestamp - created > delta:
                 shutil.rmtree(folder)
                 info.append(f"备份 {folder} 已删除！")
         return "\n".join(info)
 
-    def info_card(self, info: ImageList, user_id: str, BG_type: str | CanvasEffectHandler = canvas_effect):
-        BG_PATH = self.BG_PATH / f"{user_id}.png"
-        if not BG_PATH.exists():
-            BG_PATH = self.BG_PATH / "default.png"
+    def expire_items(self, chunk_size: int = 5000):
+        """
+        道具每日过期
+            时效道具数量减一，删除数量归零的时效道具和道具库中不存在的道具。
+            按 id 分段提交，每段一个短事务，避免长时间锁库。
+            return: (减少的库存数, 删除的库存数)
+        """
+        known = set(self.items_library.keys())
+        updated = deleted = 0
+        for BankType in (UserBank, AccountBank):
+            bank_id = col(BankType.id)
+            item_id = col(BankType.item_id)
+            items = item_id.startswith("item:")
+            with self.db.session as session:
+                low, high = session.exec(select(func.min(bank_id), func.max(bank_id))).one()
+                # 道具种类远少于库存条数，先一次找出道具库中不存在的道具
+                unknown = [key for key in session.exec(select(item_id).where(items).distinct()).all() if key not in known]
+            if low is None or high is None:
+                continue
+            # 道具 id 的第 8 位是时效，0 为时效道具
+            timed = func.substr(item_id, 8, 1) == "0"
+            expired = and_(timed, col(BankType.n) <= 0)
+            if unknown:
+                expired = or_(expired, item_id.in_(unknown))
+            for start in range(low, high + 1, chunk_size):
+                window = bank_id.between(start, start + chunk_size - 1)
+                with self.db.session as session:
+                    result = session.execute(update(BankType).where(window, items, timed).values(n=col(BankType.n) - 1))
+                    updated += result.rowcount
+                    result = session.execute(delete(BankType).where(window, items, expired))
+                    deleted += result.rowcount
+                    session.commit()
+        return updated, deleted
+
+    def draw_info_card(self, info: ImageList, user_id: str, BG_type: str | CanvasEffectHandler = canvas_effect):
         output = BytesIO()
-        info_splicing(info, BG_PATH, spacing=10, BG_type=BG_type).save(output, format="png")
+        if isinstance(BG_type, str):
+            BG_PATH = self.BG_PATH / f"{user_id}.png"
+            if not BG_PATH.exists():
+                BG_PATH = self.BG_PATH / "default.png"
+            info_splicing(info, BG_PATH, BG_type=BG_type, **card_layout).save(output, format="png")
+            return output
+        width, padding, spacing = card_layout["width"], card_layout["padding"], card_layout["spacing"]
+        size = (width + padding * 2, sum(image.size[1] + spacing * 2 for image in info) + padding * 2 - spacing)
+        if (layer := self.background.layer(user_id, size)) is None:
+            # 没有背景图片，与原来一样交给 info_splicing
+            info_splicing(info, None, BG_type=BG_type, **card_layout).save(output, format="png")
+            return output
+        canvas = layer.copy()
+        if BG_type is canvas_effect:
+            BG_type = layer_effect(self.background.layer(user_id, size, blur=True))  # type: ignore
+        height = padding
+        for image in info:
+            BG_type(canvas, image, padding, width, height)
+            height += image.size[1] + spacing * 2
+        canvas.save(output, format="png")
         return output
 
+    def info_card(self, info: ImageList, user_id: str, BG_type: str | CanvasEffectHandler = canvas_effect):
+        """
+        在渲染线程池中合成信息卡片
+            return: Future[BytesIO]，可以直接作为处理器的返回值
+        """
+        return submit(self.draw_info_card, info, user_id, BG_type)
+
     def account(self, event: Event, session: Session):
         user_id = event.user_id
         user = self.db.user(user_id, session)
@@ -87,15 +306,13 @@ class Manager:
         if not group_id:
             return None
         account = self.db.account(user_id, group_id, session)
-        nickname = event.nickname
-        if event.nickname:
-            account.name = nickname
-            if event.is_private() or not user.name:
+        if nickname := event.nickname:
+            if account.name != nickname:
+                account.name = nickname
+                session.add(account)
+            if (event.is_private() or not user.name) and user.name != nickname:
                 user.name = nickname
                 session.add(user)
-            session.add(account)
-            session.commit()
-            session.refresh(account)
         return account
 
     def transfer(
@@ -1,11 +1,16 @@
-from typing import Any, ClassVar
+import asyncio
+import weakref
+from typing import Any, ClassVar, Concatenate
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from sqlmodel import SQLModel as BaseSQLModel, Session, select, asc
+from sqlmodel import SQLModel as BaseSQLModel, Session as BaseSession, select, asc, desc
 from sqlmodel import Field, Relationship
 from sqlmodel import create_engine, col
-from sqlalchemy import Column
+from sqlalchemy import Column, Index, inspect, event
 from sqlalchemy.ext.mutable import MutableDict, MutableList
-from sqlalchemy.dialects.sqlite import JSON as SQLiteJSON
+from sqlalchemy.dialects.sqlite import JSON as SQLiteJSON, insert as sqlite_insert
+from .tools import LRUCache
 
 
 class SQLModel(BaseSQLModel):
@@ -14,6 +19,80 @@ class SQLModel(BaseSQLModel):
         return select(cls)
 
 
+class Session(BaseSession):
+    """
+    数据库会话
+
+    会话内的库存变化记录在账本中，退出会话时一次性提交
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.ledger: dict[tuple[type["BaseBank"], Any, str], "BaseBank"] = {}
+
+    def bank[T: "BaseBank"](self, BankType: type[T], bound_id: Any, item_id: str) -> T:
+        """
+        获取库存，同一会话内的同一库存只查询一次
+        """
+        key = (BankType, bound_id, item_id)
+        if (bank := self.ledger.get(key)) is None:
+            bank = self.exec(BankType.select_item(bound_id, item_id)).one_or_none() or BankType(item_id=item_id, bound_id=bound_id)
+            self.ledger[key] = bank
+        return bank  # type: ignore
+
+    def grant(self, BankType: type["BaseBank"], bound_id: Any, amounts: dict[str, int]):
+        """
+        批量增加库存
+            用一条 INSERT ... ON CONFLICT 语句写入全部道具，不逐条查询库存。
+            账本中的同一库存先写入数据库，再从账本移除并在下次访问时重新加载。
+            绕过 ORM 的写入不会触发映射事件，写入记录在 session.info["grants"] 中，供提交前的监听者读取。
+            amounts: {item_id: 数量}，只处理数量大于 0 的道具
+        """
+        amounts = {item_id: n for item_id, n in amounts.items() if n > 0}
+        if not amounts:
+            return
+        self.flush()
+        for item_id in amounts:
+            if (bank := self.ledger.pop((BankType, bound_id, item_id), None)) is not None and inspect(bank).persistent:
+                self.expire(bank)
+        table = BankType.__table__  # type: ignore
+        stmt = sqlite_insert(table).values([{"bound_id": bound_id, "item_id": item_id, "n": n} for item_id, n in amounts.items()])
+        stmt = stmt.on_conflict_do_update(index_elements=["bound_id", "item_id"], set_={"n": table.c.n + stmt.excluded.n})
+        self.execute(stmt)
+        self.info.setdefault("grants", []).append((BankType, bound_id, list(amounts)))
+
+    def settle(self):
+        """
+        结算账本：删除已清空的库存
+        """
+        for bank in self.ledger.values():
+            if bank.n > 0:
+                continue
+            state = inspect(bank)
+            if state.persistent:
+                self.delete(bank)
+            elif state.pending:
+                self.expunge(bank)
+        self.ledger.clear()
+
+    def commit(self) -> None:
+        self.settle()
+        super().commit()
+        self.info.pop("grants", None)
+
+    def rollback(self) -> None:
+        self.ledger.clear()
+        self.info.pop("grants", None)
+        super().rollback()
+
+    def __exit__(self, type_, value, traceback) -> None:
+        try:
+            if type_ is None and self.is_active:
+                self.commit()
+        finally:
+            super().__exit__(type_, value, traceback)
+
+
 class BaseItem:
     id: str
     name: str
@@ -26,20 +105,21 @@ class BaseItem:
         raise NotImplementedError
 
     def corp_deal(self, group: "Group", unsettled: int, session: Session):
-        bank = group.item(self.id, session).one_or_none() or GroupBank(item_id=self.id, bound_id=group.id)
+        bank = session.bank(GroupBank, group.id, self.id)
         return self.bank_deal(bank, unsettled, session)
 
     @staticmethod
     def bank_deal(bank: "BaseBank", unsettled: int, session: Session):
+        """
+        库存变化记入账本，由会话统一提交
+            return:数量不足时返回当前数量
+        """
         if unsettled < 0 and bank.n < (-unsettled):
             return bank.n
         bank.n += unsettled
-        if bank.n <= 0:
-            if bank in session:
-                session.delete(bank)
-        else:
+        if bank.n > 0:
             session.add(bank)
-        session.commit()
+        session.ledger.setdefault((type(bank), bank.bound_id, bank.item_id), bank)
 
 
 class BaseBank(SQLModel):
@@ -73,6 +153,10 @@ class Entity(SQLModel):
 
 
 class Exchange(BaseBank, table=True):
+    __table_args__ = (
+        Index("ix_exchange_bound_id_item_id_user_id", "bound_id", "item_id", "user_id", unique=True),
+        Index("ix_exchange_bound_id_quote", "bound_id", "quote"),
+    )
     stock: "Stock" = Relationship(back_populates="exchange")
     bound_id: str = Field(foreign_key="stock.id", index=True)
     # relation
@@ -80,6 +164,8 @@ class Exchange(BaseBank, table=True):
     user_id: str = Field(foreign_key="user.id", index=True)
     #  data
     quote: float = 0.0
+    time: datetime = Field(default_factory=datetime.now)
+    """挂单时间"""
 
     def deal(self, unsettled: int, session: Session):
         time_log = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -90,16 +176,28 @@ class Exchange(BaseBank, table=True):
             session.delete(self)
         # 理论上用户存在库存且数量应大于等于 settle
         # 但为了健壮性这里做冗余处理
-        bank = self.user.item(self.bound_id, session).one_or_none()
-        if bank is not None:
-            if self.stock.bank_deal(bank, -settle, session) is not None:
-                session.delete(bank)
+        bank = session.bank(UserBank, self.user_id, self.bound_id)
+        if self.stock.bank_deal(bank, -settle, session) is not None:
+            # 库存不足时清空，由账本结算时删除
+            bank.n = 0
         return unsettled - settle
 
 
+class StockRecord(SQLModel, table=True):
+    __table_args__ = (Index("ix_stockrecord_stock_id_time", "stock_id", "time"),)
+    id: int | None = Field(default=None, primary_key=True)
+    stock: "Stock" = Relationship(back_populates="records")
+    stock_id: str = Field(foreign_key="stock.id")
+    time: float = Field(index=True)
+    """时间戳"""
+    price: float
+    """股价"""
+
+
 class Stock(BaseItem, Entity, table=True):
     BankType = Exchange
     exchange: list[Exchange] = Relationship(back_populates="stock", cascade_delete=True)
+    records: list[StockRecord] = Relationship(back_populates="stock", cascade_delete=True)
     # relation
     group: "Group" = Relationship(back_populates="stock")
     group_id: str = Field(foreign_key="group.id", index=True)
@@ -119,13 +217,22 @@ class Stock(BaseItem, Entity, table=True):
         self.floating = float(value)
 
     def bank(self, account: "Account", session: Session):
-        return account.user.item(self.id, session).one_or_none() or UserBank(item_id=self.id, bound_id=account.user_id)
+        return session.bank(UserBank, account.user_id, self.id)
+
+    def history(self, session: Session, limit: int = 720) -> list[tuple[float, float]]:
+        """
+        最近的股价记录
+            return: [(时间戳, 股价)]，按时间升序
+        """
+        query = select(StockRecord.time, StockRecord.price).where(StockRecord.stock_id == self.id)
+        query = query.order_by(desc(StockRecord.time)).limit(limit)
+        return [(t, price) for t, price in reversed(session.exec(query).all())]
 
     def market(self, session: Session, quote: float = 0, limit: int = 0):
         query = select(Exchange).where(Exchange.bound_id == self.id, Exchange.item_id == self.id, Exchange.quote > 0.0)
         if quote > 0:
             query = query.where(Exchange.quote <= quote)
-        query = query.order_by(asc(Exchange.quote))
+        query = query.order_by(asc(Exchange.quote), asc(Exchange.time))
         if limit > 0:
             query = query.limit(limit)
         return session.exec(query).all()
@@ -141,6 +248,7 @@ class Stock(BaseItem, Entity, table=True):
 
 
 class AccountBank(BaseBank, table=True):
+    __table_args__ = (Index("ix_accountbank_bound_id_item_id", "bound_id", "item_id", unique=True),)
     account: "Account" = Relationship(back_populates="bank")
     bound_id: int = Field(foreign_key="account.id")
 
@@ -156,6 +264,8 @@ class Account(Entity, table=True):
     group_id: str = Field(foreign_key="group.id", index=True)
     # data
     sign_in: datetime | None = None
+    revolution: bool = True
+    """是否可以领取重置签到"""
     extra: dict[str, Any] = Field(default_factory=dict, sa_column=Column(MutableDict.as_mutable(SQLiteJSON())))
 
     @property
@@ -164,16 +274,63 @@ class Account(Entity, table=True):
 
 
 class UserBank(BaseBank, table=True):
+    __table_args__ = (Index("ix_userbank_bound_id_item_id", "bound_id", "item_id", unique=True),)
     user: "User" = Relationship(back_populates="bank")
     bound_id: str = Field(foreign_key="user.id")
 
 
+class UserStats(SQLModel, table=True):
+    """对战战绩，每列都有索引，排行榜只需按索引取前 N 名"""
+
+    user: "User" = Relationship(back_populates="stats")
+    user_id: str = Field(foreign_key="user.id", primary_key=True)
+    win: int = Field(default=0, index=True)
+    """胜场"""
+    lose: int = Field(default=0, index=True)
+    """败场"""
+    win_streak: int = Field(default=0, index=True)
+    """连胜"""
+    lose_streak: int = Field(default=0, index=True)
+    """连败"""
+    win_streak_max: int = Field(default=0, index=True)
+    """最大连胜"""
+    lose_streak_max: int = Field(default=0, index=True)
+    """最大连败"""
+
+    def record_win(self):
+        self.win += 1
+        self.win_streak += 1
+        self.win_streak_max = max(self.win_streak_max, self.win_streak)
+        self.lose_streak = 0
+
+    def record_lose(self):
+        self.lose += 1
+        self.lose_streak += 1
+        self.lose_streak_max = max(self.lose_streak_max, self.lose_streak)
+        self.win_streak = 0
+
+
+class UserWealth(SQLModel, table=True):
+    """
+    账户库存按群等级加权后的全群合计
+        由数据库触发器维护（见 migration.user_wealth_table），不要直接修改
+    """
+
+    __table_args__ = (Index("ix_userwealth_item_id_value", "item_id", "value"),)
+    user: "User" = Relationship(back_populates="wealth")
+    user_id: str = Field(foreign_key="user.id", primary_key=True)
+    item_id: str = Field(primary_key=True)
+    value: int = 0
+
+
 class User(Entity, table=True):
     BankType = UserBank
     bank: list[UserBank] = Relationship(back_populates="user", cascade_delete=True)
     # relation
     accounts: list[Account] = Relationship(back_populates="user", cascade_delete=True)
     exchange: list[Exchange] = Relationship(back_populates="user", cascade_delete=True)
+    stats: UserStats | None = Relationship(back_populates="user", cascade_delete=True)
+    wealth: list[UserWealth] = Relationship(back_populates="user", cascade_delete=True)
     # data
     avatar_url: str = ""
     connect: str = ""
@@ -185,6 +342,7 @@ class User(Entity, table=True):
 
 
 class GroupBank(BaseBank, table=True):
+    __table_args__ = (Index("ix_groupbank_bound_id_item_id", "bound_id", "item_id", unique=True),)
     group: "Group" = Relationship(back_populates="bank")
     bound_id: str = Field(foreign_key="group.id")
 
@@ -223,13 +381,38 @@ class Group(Entity, table=True):
 
 
 class DataBase:
-    def __init__(self, DATABASE_URL: str) -> None:
-        self.engine = create_engine(DATABASE_URL)
+    def __init__(
+        self,
+        DATABASE_URL: str,
+        pragmas: dict[str, str | int] | None = None,
+        pool_size: int = 4,
+        cache_size: int = 4096,
+    ) -> None:
+        self.engine = create_engine(
+            DATABASE_URL,
+            pool_size=pool_size,
+            max_overflow=0,
+            connect_args={"check_same_thread": False},
+        )
+        if pragmas:
+
+            @event.listens_for(self.engine, "connect")
+            def _(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for key, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {key}={value}")
+                cursor.close()
+
         SQLModel.metadata.create_all(self.engine)
+        self.account_ids = LRUCache[tuple[str, str], int](cache_size)
+        """账户缓存 (user_id, group_id) -> account_id"""
+        databases.add(self)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clovers_sarof_db")
+        """数据库线程，所有异步会话排队在此线程中执行"""
 
     @classmethod
-    def load(cls, DATABASE_URL: str):
-        return cls(DATABASE_URL)
+    def load(cls, DATABASE_URL: str, pragmas: dict[str, str | int] | None = None, pool_size: int = 4, cache_size: int = 4096):
+        return cls(DATABASE_URL, pragmas, pool_size, cache_size)
 
     def user(self, user_id: str, session: Session):
         user = session.get(User, user_id)
@@ -238,6 +421,13 @@ class DataBase:
             session.add(user)
         return user
 
+    def stats(self, user_id: str, session: Session):
+        stats = session.get(UserStats, user_id)
+        if stats is None:
+            stats = UserStats(user_id=self.user(user_id, session).id)
+            session.add(stats)
+        return stats
+
     def group(self, group_id: str, session: Session):
         group = session.get(Group, group_id)
         if group is None:
@@ -246,19 +436,55 @@ class DataBase:
         return group
 
     def account(self, user_id: str, group_id: str, session: Session):
+        key = (user_id, group_id)
+        # 缓存命中时只需一次主键查询，id 被复用或账户已删除时回退到条件查询
+        if (account_id := self.account_ids.get(key)) is not None:
+            account = session.get(Account, account_id)
+            if account is not None and account.user_id == user_id and account.group_id == group_id:
+                return account
+            self.account_ids.pop(key)
         query = select(Account).where(Account.user_id == user_id, Account.group_id == group_id)
         account = session.exec(query).one_or_none()
-        user = self.user(user_id, session)
-        group = self.group(group_id, session)
         if account is None:
+            user = self.user(user_id, session)
+            group = self.group(group_id, session)
             account = Account(name="", user_id=user.id, group_id=group.id)
             session.add(account)
-            session.commit()
+            session.flush()
+        self.account_ids.set(key, account.id)
         return account
 
     @property
     def session(self):
-        return Session(self.engine)
+        return Session(self.engine, expire_on_commit=False)
+
+    async def run[**P, T](self, func: Callable[Concatenate[Session, P], T], *args: P.args, **kwargs: P.kwargs) -> T:
+        """
+        在数据库线程中打开会话并执行 func(session, *args, **kwargs)，不阻塞事件循环
+        """
+
+        def transaction():
+            with self.session as session:
+                return func(session, *args, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, transaction)
+
+    def close(self):
+        databases.discard(self)
+        self.executor.shutdown()
+        self.engine.dispose()
+
+
+databases: weakref.WeakSet[DataBase] = weakref.WeakSet()
+"""已打开的数据库，只持有弱引用"""
+
+
+@event.listens_for(Account, "after_delete")
+def _(mapper, connection, target: Account):
+    # 删除账户后移出所在数据库的账户缓存
+    for db in list(databases):
+        if db.engine is connection.engine:
+            db.account_ids.pop((target.user_id, target.group_id))
 
 
 class Item(BaseItem):
@@ -326,11 +552,28 @@ class Item(BaseItem):
     def bank(self, account: Account, session: Session) -> BaseBank:
         raise NotImplementedError
 
+    @staticmethod
+    def grant(account: Account, items: Iterable[tuple["Item", int]], session: Session):
+        """
+        批量发放道具，按作用域分别写入账户库存和用户库存，每种库存一条语句
+            items: [(道具, 数量)]，相同道具的数量合并
+        """
+        account_id = account.id
+        if account_id is None:
+            raise ValueError("account_id is None")
+        user_amounts: dict[str, int] = {}
+        account_amounts: dict[str, int] = {}
+        for item, n in items:
+            amounts = user_amounts if item.domain == 2 else account_amounts
+            amounts[item.id] = amounts.get(item.id, 0) + n
+        session.grant(AccountBank, account_id, account_amounts)
+        session.grant(UserBank, account.user_id, user_amounts)
+
     def account_bank(self, account: Account, session: Session):
         account_id = account.id
         if account_id is None:
             raise ValueError("account_id is None")
-        return account.item(self.id, session).one_or_none() or AccountBank(item_id=self.id, bound_id=account_id)
+        return session.bank(AccountBank, account_id, self.id)
 
     def user_bank(self, account: Account, session: Session):
-        return account.user.item(self.id, session).one_or_none() or UserBank(item_id=self.id, bound_id=account.user_id)
+        return session.bank(UserBank, account.user_id, self.id)
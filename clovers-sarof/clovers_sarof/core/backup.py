@@ -0,0 +1,144 @@
+"""
+数据库在线备份
+
+备份通过 SQLite backup API 分步复制页面，期间不阻塞其他连接的读写。
+每天第一次备份保存为完整快照，当天之后的备份只保存与该快照不同的页面（差异快照）。
+"""
+
+import time
+import struct
+import sqlite3
+from pathlib import Path
+from typing import IO
+from collections.abc import Iterator
+
+DIFF_MAGIC = b"SAROFDIF"
+"""差异快照文件头"""
+DIFF_HEADER = struct.Struct(">IIH")
+"""页面大小，页面数量，完整快照文件名长度"""
+PAGE_NUMBER = struct.Struct(">I")
+
+
+def open_file(file: Path, mode: str) -> IO[bytes]:
+    """打开备份文件，.zst 结尾的文件使用 zstd 流式压缩"""
+    if file.suffix != ".zst":
+        return open(file, mode)
+    import zstandard
+
+    if mode == "rb":
+        return zstandard.ZstdDecompressor().stream_reader(open(file, "rb"), closefd=True)
+    return zstandard.ZstdCompressor().stream_writer(open(file, "wb"), closefd=True)
+
+
+def is_snapshot(file: Path):
+    """是否为完整快照"""
+    return ".db" in file.suffixes
+
+
+def online_backup(source: Path, target: Path, pages: int, sleep: float):
+    """
+    在线备份数据库
+
+        source: 数据库文件
+        target: 备份文件（未压缩）
+        pages: 每步复制的页面数
+        sleep: 每步之间的间隔（秒）
+    """
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        # 持有读事务，备份期间始终使用同一个数据快照，其他连接的写入不会导致备份重新开始
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=pages, progress=lambda *_: time.sleep(sleep))
+        src.rollback()
+    finally:
+        dst.close()
+        src.close()
+
+
+def page_size_of(header: bytes):
+    """读取数据库文件头中的页面大小"""
+    size = int.from_bytes(header[16:18], "big")
+    return 65536 if size == 1 else size
+
+
+def read_exact(stream: IO[bytes], size: int):
+    """读取 size 字节，解压流单次读取可能不足"""
+    data = stream.read(size)
+    while data and len(data) < size and (more := stream.read(size - len(data))):
+        data += more
+    return data
+
+
+def iter_pages(stream: IO[bytes], page_size: int) -> Iterator[bytes]:
+    while page := read_exact(stream, page_size):
+        yield page
+
+
+def save_snapshot(snapshot: Path, target: Path, chunk: int = 1 << 20):
+    """保存完整快照"""
+    with open(snapshot, "rb") as src, open_file(target, "wb") as dst:
+        while data := src.read(chunk):
+            dst.write(data)
+
+
+def save_diff(base: Path, snapshot: Path, target: Path):
+    """
+    保存差异快照
+
+        base: 当天的完整快照
+        snapshot: 本次备份（未压缩）
+        target: 差异快照文件
+    """
+    with open(snapshot, "rb") as new:
+        header = new.read(100)
+        page_size = page_size_of(header)
+        new.seek(0)
+        page_count = snapshot.stat().st_size // page_size
+        base_name = base.name.encode()
+        with open_file(base, "rb") as old, open_file(target, "wb") as dst:
+            dst.write(DIFF_MAGIC)
+            dst.write(DIFF_HEADER.pack(page_size, page_count, len(base_name)))
+            dst.write(base_name)
+            old_pages = iter_pages(old, page_size)
+            for i, page in enumerate(iter_pages(new, page_size)):
+                if next(old_pages, None) != page:
+                    dst.write(PAGE_NUMBER.pack(i))
+                    dst.write(page)
+
+
+def rebuild(file: Path, target: Path):
+    """
+    从备份重建数据库文件
+
+        file: 完整快照或差异快照
+        target: 重建的数据库文件
+    """
+    if is_snapshot(file):
+        with open_file(file, "rb") as src, open(target, "wb") as dst:
+            while data := src.read(1 << 20):
+                dst.write(data)
+        return
+    with open_file(file, "rb") as diff:
+        if read_exact(diff, len(DIFF_MAGIC)) != DIFF_MAGIC:
+            raise ValueError(f"{file} 不是差异快照")
+        page_size, page_count, name_length = DIFF_HEADER.unpack(read_exact(diff, DIFF_HEADER.size))
+        rebuild(file.parent / read_exact(diff, name_length).decode(), target)
+        with open(target, "r+b") as dst:
+            dst.truncate(page_size * page_count)
+            while number := read_exact(diff, PAGE_NUMBER.size):
+                (i,) = PAGE_NUMBER.unpack(number)
+                dst.seek(i * page_size)
+                dst.write(read_exact(diff, page_size))
+
+
+def online_restore(source: Path, target: Path):
+    """把重建的数据库文件一次性写回正在使用的数据库，其他连接不会读到写了一半的数据"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
@@ -1,14 +1,19 @@
+import hashlib
+from collections import deque
 from collections.abc import Iterable
 from datetime import datetime
 from io import BytesIO
 from PIL import Image, ImageDraw
+from PIL.Image import Image as IMG
 from linecard import Linecard, ImageList
 from matplotlib.font_manager import FontProperties
 import matplotlib.pyplot as plt
 import mplfinance as mpf
 import pandas as pd
 import numpy as np
-from .tools import format_number
+import threading
+from .tools import format_number, ohlc, OHLCBars, LRUCache
+from .render import plot_lock
 from .account import Stock, Item
 from ._config import __config__
 
@@ -76,13 +81,35 @@ def stock_card(data: list[tuple[Stock, int]]):
 
 
 CIRCLE_260_MASK = create_circle_mask(260)
+CIRCLE_60_MASK = create_circle_mask(60)
+CIRCLE_MASKS = {260: CIRCLE_260_MASK, 60: CIRCLE_60_MASK}
+
+avatar_thumbnails = LRUCache[tuple[bytes, int], IMG](maxweight=64 << 20, weigh=lambda image: image.width * image.height * 4)
+"""圆形头像缩略图缓存 (头像内容哈希, 尺寸) -> 缩略图"""
+
+
+def avatar_thumbnail(avatar: bytes | None, size: int) -> IMG | None:
+    """
+    圆形头像缩略图
+        按头像内容缓存，返回的图片是共享的，不要修改；头像无法解码时返回 None
+    """
+    if not avatar:
+        return None
+    key = (hashlib.blake2b(avatar, digest_size=16).digest(), size)
+    if (thumbnail := avatar_thumbnails.get(key)) is None:
+        try:
+            thumbnail = Image.open(BytesIO(avatar)).convert("RGBA").resize((size, size))
+        except OSError:
+            return None
+        thumbnail.putalpha(CIRCLE_MASKS.get(size) or create_circle_mask(size))
+        avatar_thumbnails.set(key, thumbnail)
+    return thumbnail
 
 
 def avatar_card(avatar: bytes | None, nickname: str, lines: list[str] | None = None):
     # assert len(lines) <= 3
     canvas = Image.new("RGBA", (880, 300))
-    if avatar:
-        (avatar_image := Image.open(BytesIO(avatar)).resize((260, 260))).putalpha(CIRCLE_260_MASK)
+    if (avatar_image := avatar_thumbnail(avatar, 260)) is not None:
         canvas.paste(avatar_image, (20, 20))
     draw = ImageDraw.Draw(canvas)
     canvas.paste(linecard(nickname, 40, width=580, padding=(0, 10)), (300, 40))
@@ -106,17 +133,17 @@ def candlestick(figsize: tuple[float, float], length: int, history: list[tuple[f
         length:OHLC采样长度
         history:历史数据
     """
-    t, price = zip(*history)
-    l = len(t)
-    t = [t[i : i + length] for i in range(0, l, length)]
-    price = [price[i : i + length] for i in range(0, l, length)]
-    D, O, H, L, C = [], [], [], [], []
-    for i in range(len(price)):
-        D.append(datetime.fromtimestamp(t[i][0]))
-        O.append(price[i][0])
-        H.append(max(price[i]))
-        L.append(min(price[i]))
-        C.append(price[i][-1])
+    return candlestick_ohlc(figsize, ohlc(history, length))
+
+
+def candlestick_ohlc(figsize: tuple[float, float], bars: list[tuple[float, float, float, float, float]]):
+    """
+    根据K线数据生成股价K线图
+        figsize:图片尺寸
+        bars:[(时间戳, 开, 高, 低, 收)]
+    """
+    T, O, H, L, C = zip(*bars)
+    D = [datetime.fromtimestamp(t) for t in T]
     data = pd.DataFrame({"date": D, "open": O, "high": H, "low": L, "close": C})
     data = data.set_index("date")
     style = mpf.make_mpf_style(
@@ -127,20 +154,96 @@ def candlestick(figsize: tuple[float, float], length: int, history: list[tuple[f
         figcolor="none",
     )
     output = BytesIO()
-    mpf.plot(
-        data,
-        type="candlestick",
-        xlabel="",
-        ylabel="",
-        datetime_format="%H:%M",
-        tight_layout=True,
-        style=style,
-        figsize=figsize,
-        savefig=output,
-    )
+    with plot_lock:
+        mpf.plot(
+            data,
+            type="candlestick",
+            xlabel="",
+            ylabel="",
+            datetime_format="%H:%M",
+            tight_layout=True,
+            style=style,
+            figsize=figsize,
+            savefig=output,
+        )
     return Image.open(output)
 
 
+class CandlestickCache:
+    """
+    K线图缓存
+        K线随 stock_update 增量更新，图片按 (股票, 最后一次更新, 尺寸) 缓存，股价变化前重复请求直接复用
+    """
+
+    def __init__(self, length: int = 12, window: int = 720, maxsize: int = 256) -> None:
+        self.length = length
+        """OHLC采样长度"""
+        self.window = window
+        """K线覆盖的股价记录数"""
+        self.series: dict[str, OHLCBars] = {}
+        self.pending: dict[str, deque[tuple[float, float]]] = {}
+        """正在加载的股票，暂存加载完成前的股价"""
+        self.images = LRUCache[tuple[str, float, tuple[float, float]], IMG](maxsize)
+        self.lock = threading.Lock()
+
+    def loaded(self, stock_id: str):
+        """
+        检查K线是否已加载
+            未加载时开始暂存新的股价，之后需要调用 load_if_missing
+        """
+        with self.lock:
+            if stock_id in self.series:
+                return True
+            self.pending.setdefault(stock_id, deque(maxlen=self.window))
+            return False
+
+    def load_if_missing(self, stock_id: str, history: list[tuple[float, float]]):
+        """用数据库中的股价记录初始化K线，并补上查询之后记录的股价"""
+        with self.lock:
+            if stock_id in self.series:
+                return
+            bars = OHLCBars(self.length, self.window // self.length)
+            bars.extend(history)
+            last_tick = history[-1][0] if history else 0.0
+            bars.extend((t, price) for t, price in self.pending.pop(stock_id, ()) if t > last_tick)
+            self.series[stock_id] = bars
+
+    def record(self, stock_id: str, t: float, price: float):
+        """记录新的股价，只更新已加载或正在加载的股票"""
+        with self.lock:
+            if (bars := self.series.get(stock_id)) is not None:
+                bars.update(t, price)
+            elif (pending := self.pending.get(stock_id)) is not None:
+                pending.append((t, price))
+
+    def discard(self, stock_id: str):
+        with self.lock:
+            self.series.pop(stock_id, None)
+            self.pending.pop(stock_id, None)
+
+    def clear(self):
+        """清空全部K线和图片"""
+        with self.lock:
+            self.series.clear()
+            self.pending.clear()
+            self.images.clear()
+
+    def chart(self, stock_id: str, figsize: tuple[float, float]):
+        with self.lock:
+            if (bars := self.series.get(stock_id)) is None or not (data := bars.data()):
+                return None
+            key = (stock_id, bars.last_tick, figsize)
+        if (image := self.images.get(key)) is None:
+            image = candlestick_ohlc(figsize, data)
+            image.load()
+            self.images.set(key, image)
+        return image.copy()
+
+
+candlestick_cache = CandlestickCache()
+"""K线图缓存实例"""
+
+
 def dist_card(
     dist: list[tuple[int, str]],
     colors=[
@@ -170,37 +273,33 @@ def dist_card(
             break
     n += 1
     output = BytesIO()
-
-    plt.figure(figsize=(6.6, 3.4))
-    plt.pie(
-        np.array(x),
-        labels=[""] * n,
-        autopct=lambda pct: "" if pct < 1 else f"{pct:.1f}%",
-        colors=colors[0:n],
-        wedgeprops={"edgecolor": "none"},
-        textprops={"fontsize": 15},
-        pctdistance=1.2,
-        explode=[0, 0.1, 0.19, 0.27, 0.34, 0.40, 0.45, 0.49, 0.52][0:n],
-    )
-    plt.legend(labels, loc=(-0.6, 0), frameon=False)
-    plt.axis("equal")
-    plt.subplots_adjust(top=0.95, bottom=0.05, left=0.4, hspace=0, wspace=0)
-    plt.savefig(output, format="png", dpi=100, transparent=True)
-    plt.close()
+    with plot_lock:
+        plt.figure(figsize=(6.6, 3.4))
+        plt.pie(
+            np.array(x),
+            labels=[""] * n,
+            autopct=lambda pct: "" if pct < 1 else f"{pct:.1f}%",
+            colors=colors[0:n],
+            wedgeprops={"edgecolor": "none"},
+            textprops={"fontsize": 15},
+            pctdistance=1.2,
+            explode=[0, 0.1, 0.19, 0.27, 0.34, 0.40, 0.45, 0.49, 0.52][0:n],
+        )
+        plt.legend(labels, loc=(-0.6, 0), frameon=False)
+        plt.axis("equal")
+        plt.subplots_adjust(top=0.95, bottom=0.05, left=0.4, hspace=0, wspace=0)
+        plt.savefig(output, format="png", dpi=100, transparent=True)
+        plt.close()
     canvas = Image.new("RGBA", (880, 340))
     canvas.paste(Image.open(output), (220, 0))
     return canvas
 
 
-CIRCLE_60_MASK = create_circle_mask(60)
-
-
 def avatar_list(data: Iterable[tuple[bytes | None, str]]) -> ImageList:
     image_list = []
     for avatar, text in data:
         canvas = linecard(f"[pixel 70]{text}", 40, width=880, height=70, padding=(0, 15))
-        if avatar:
-            (avatar_image := Image.open(BytesIO(avatar)).resize((60, 60))).putalpha(CIRCLE_60_MASK)
+        if (avatar_image := avatar_thumbnail(avatar, 60)) is not None:
             canvas.paste(avatar_image, (5, 5))
         image_list.append(canvas)
     return image_list
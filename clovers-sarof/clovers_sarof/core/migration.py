@@ -0,0 +1,162 @@
+"""
+数据库迁移
+
+数据库版本记录在 PRAGMA user_version 中，启动时按顺序执行尚未执行的迁移。
+新建的数据库由 create_all 直接创建最新的表结构，所以每个迁移都必须可以重复执行。
+"""
+
+import json
+from collections.abc import Callable
+from sqlalchemy import Engine, Connection, Index, inspect
+from .account import AccountBank, UserBank, GroupBank, Exchange, Stock, StockRecord, User, UserStats, UserWealth, Account, Group
+
+type Migration = Callable[[Connection], None]
+
+MIGRATIONS: list[Migration] = []
+"""迁移列表，列表下标 + 1 即迁移后的数据库版本"""
+
+
+def migration(func: Migration):
+    MIGRATIONS.append(func)
+    return func
+
+
+def create_indexes(connection: Connection, *indexes: Index):
+    for index in indexes:
+        index.create(connection, checkfirst=True)
+
+
+def add_column(connection: Connection, table: str, column: str, ddl: str):
+    """表中没有该列时添加"""
+    if column not in {c["name"] for c in inspect(connection).get_columns(table)}:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def upgrade(engine: Engine):
+    """把数据库升级到最新版本"""
+    with engine.begin() as connection:
+        current: int = connection.exec_driver_sql("PRAGMA user_version").scalar_one()
+        for version, func in enumerate(MIGRATIONS[current:], current + 1):
+            func(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {version}")
+
+
+@migration
+def bank_unique_index(connection: Connection):
+    """库存 (bound_id, item_id) 唯一索引，交易所 (bound_id, quote) 索引"""
+    for BankType in (AccountBank, UserBank, GroupBank):
+        table = BankType.__tablename__
+        # 合并重复库存到 id 最小的一行
+        connection.exec_driver_sql(
+            f"UPDATE {table} SET n = (SELECT SUM(d.n) FROM {table} AS d WHERE d.bound_id = {table}.bound_id AND d.item_id = {table}.item_id) "
+            f"WHERE id IN (SELECT MIN(id) FROM {table} GROUP BY bound_id, item_id HAVING COUNT(*) > 1)"
+        )
+        connection.exec_driver_sql(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY bound_id, item_id)")
+    # 同一用户同一股票只保留最后发布的交易信息
+    table = Exchange.__tablename__
+    connection.exec_driver_sql(f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY bound_id, item_id, user_id)")
+    create_indexes(
+        connection,
+        *(index for BankType in (AccountBank, UserBank, GroupBank, Exchange) for index in BankType.__table__.indexes),  # type: ignore
+    )
+
+
+@migration
+def exchange_time(connection: Connection):
+    """交易所挂单时间，用于同价订单的时间优先"""
+    table = Exchange.__tablename__
+    add_column(connection, table, "time", "DATETIME")
+    connection.exec_driver_sql(f"UPDATE {table} SET time = CURRENT_TIMESTAMP WHERE time IS NULL")
+
+
+@migration
+def stock_record_table(connection: Connection):
+    """股价记录从 Stock.extra["record"] 迁移到 StockRecord 表"""
+    stock_table = Stock.__tablename__
+    record_table = StockRecord.__tablename__
+    for stock_id, extra in connection.exec_driver_sql(f"SELECT id, extra FROM {stock_table}").all():
+        extra = json.loads(extra) if extra else {}
+        if "record" not in extra:
+            continue
+        # 旧记录用 (0.0, 0.0) 补齐了长度
+        records = [(stock_id, t, price) for t, price in extra.pop("record") if t > 0]
+        if records:
+            connection.exec_driver_sql(f"INSERT INTO {record_table} (stock_id, time, price) VALUES (?, ?, ?)", records)
+        connection.exec_driver_sql(f"UPDATE {stock_table} SET extra = ? WHERE id = ?", (json.dumps(extra), stock_id))
+
+
+@migration
+def user_stats_table(connection: Connection):
+    """对战战绩从 User.extra 迁移到 UserStats 表"""
+    user_table = User.__tablename__
+    stats_table = UserStats.__tablename__
+    keys = ("win", "lose", "win_streak", "lose_streak", "win_streak_max", "lose_streak_max")
+    for user_id, extra in connection.exec_driver_sql(f"SELECT id, extra FROM {user_table}").all():
+        extra = json.loads(extra) if extra else {}
+        if not any(key in extra for key in keys):
+            continue
+        values = [int(extra.pop(key, 0) or 0) for key in keys]
+        connection.exec_driver_sql(
+            f"INSERT OR REPLACE INTO {stats_table} (user_id, {", ".join(keys)}) VALUES (?, {", ".join("?" * len(keys))})",
+            (user_id, *values),
+        )
+        connection.exec_driver_sql(f"UPDATE {user_table} SET extra = ? WHERE id = ?", (json.dumps(extra), user_id))
+
+
+@migration
+def user_wealth_table(connection: Connection):
+    """
+    UserWealth 触发器
+        账户库存增删改时按所在群等级增减合计，群等级变化时按差值修正群内成员的合计
+    """
+    wealth = UserWealth.__tablename__
+    bank = AccountBank.__tablename__
+    account = Account.__tablename__
+    group = Group.__tablename__
+
+    def add(row: str, sign: str):
+        return (
+            f"INSERT INTO {wealth} (user_id, item_id, value) "
+            f"SELECT a.user_id, {row}.item_id, {sign}{row}.n * g.level FROM {account} AS a JOIN \"{group}\" AS g ON g.id = a.group_id "
+            f"WHERE a.id = {row}.bound_id "
+            f"ON CONFLICT (user_id, item_id) DO UPDATE SET value = value + excluded.value;"
+        )
+
+    # 删除时只更新已有的合计，避免删除用户时重新插入
+    subtract = (
+        f"UPDATE {wealth} SET value = value - OLD.n * "
+        f"(SELECT g.level FROM {account} AS a JOIN \"{group}\" AS g ON g.id = a.group_id WHERE a.id = OLD.bound_id) "
+        f"WHERE item_id = OLD.item_id AND user_id = (SELECT user_id FROM {account} WHERE id = OLD.bound_id);"
+    )
+    triggers = {
+        "insert": f"AFTER INSERT ON {bank} BEGIN {add("NEW", "")} END",
+        "update": f"AFTER UPDATE OF n, bound_id, item_id ON {bank} BEGIN {subtract} {add("NEW", "")} END",
+        "delete": f"AFTER DELETE ON {bank} BEGIN {subtract} END",
+        "level": (
+            f"AFTER UPDATE OF level ON \"{group}\" WHEN NEW.level != OLD.level BEGIN "
+            f"UPDATE {wealth} SET value = value + (NEW.level - OLD.level) * COALESCE(("
+            f"SELECT SUM(b.n) FROM {bank} AS b JOIN {account} AS a ON a.id = b.bound_id "
+            f"WHERE a.group_id = NEW.id AND a.user_id = {wealth}.user_id AND b.item_id = {wealth}.item_id), 0) "
+            f"WHERE user_id IN (SELECT user_id FROM {account} WHERE group_id = NEW.id); END"
+        ),
+    }
+    for name, body in triggers.items():
+        connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {wealth}_{name} {body}")
+    connection.exec_driver_sql(f"DELETE FROM {wealth}")
+    connection.exec_driver_sql(
+        f"INSERT INTO {wealth} (user_id, item_id, value) "
+        f"SELECT a.user_id, b.item_id, SUM(b.n * g.level) FROM {bank} AS b "
+        f"JOIN {account} AS a ON a.id = b.bound_id JOIN \"{group}\" AS g ON g.id = a.group_id "
+        f"GROUP BY a.user_id, b.item_id"
+    )
+
+
+@migration
+def account_revolution(connection: Connection):
+    """重置签到标记从 Account.extra["revolution"] 迁移到 Account.revolution 列"""
+    table = Account.__tablename__
+    add_column(connection, table, "revolution", "BOOLEAN NOT NULL DEFAULT 1")
+    connection.exec_driver_sql(
+        f"UPDATE {table} SET revolution = json_extract(extra, '$.revolution'), extra = json_remove(extra, '$.revolution') "
+        f"WHERE json_extract(extra, '$.revolution') IS NOT NULL"
+    )
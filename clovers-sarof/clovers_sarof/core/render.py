@@ -0,0 +1,27 @@
+"""
+图片渲染线程池
+
+PIL 的图像处理会释放 GIL，卡片合成放在线程池中可以同时利用多个核心，也不会阻塞事件循环。
+matplotlib / mplfinance 不是线程安全的，绘图时需要持有 plot_lock。
+"""
+
+import os
+import asyncio
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, Future
+
+executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="clovers_sarof_render")
+"""渲染线程池"""
+plot_lock = threading.Lock()
+"""matplotlib 绘图锁"""
+
+
+def submit[**P, T](func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> Future[T]:
+    """提交渲染任务，返回的 Future 可以直接作为处理器的返回值"""
+    return executor.submit(func, *args, **kwargs)
+
+
+async def render[**P, T](func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """在渲染线程池中执行 func 并等待结果"""
+    return await asyncio.wrap_future(submit(func, *args, **kwargs))
@@ -1,6 +1,13 @@
+import time
+import json
+import random
 import asyncio
+import hashlib
 import httpx
-from collections.abc import Iterable
+import threading
+from pathlib import Path
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable, Sequence
 from typing import overload
 
 
@@ -143,6 +150,171 @@ class Library[K, V]:
         return self[key]
 
 
+class LRUCache[K, V]:
+    """
+    线程安全的最近最少使用缓存
+        weigh: 计算缓存值的权重（如占用内存），设置后缓存总权重不超过 maxweight
+    """
+
+    def __init__(self, maxsize: int = 1024, maxweight: int = 0, weigh: Callable[[V], int] | None = None) -> None:
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        """当前总权重"""
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: K):
+        return key in self._data
+
+    def _weight(self, value: V):
+        return 0 if self.weigh is None else self.weigh(value)
+
+    @overload
+    def get(self, key: K) -> V | None: ...
+    @overload
+    def get(self, key: K, default: V) -> V: ...
+
+    def get(self, key: K, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: K, value: V):
+        with self._lock:
+            if key in self._data:
+                self.weight -= self._weight(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.weight += self._weight(value)
+            while len(self._data) > self.maxsize or (self.weigh is not None and self.weight > self.maxweight and len(self._data) > 1):
+                self.weight -= self._weight(self._data.popitem(last=False)[1])
+
+    @overload
+    def pop(self, key: K) -> V | None: ...
+    @overload
+    def pop(self, key: K, default: V) -> V: ...
+
+    def pop(self, key: K, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self.weight -= self._weight(value)
+            return value
+
+    def evict(self, predicate: Callable[[K], bool]):
+        """删除所有满足条件的键"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                self.weight -= self._weight(self._data.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+
+class AliasSampler[T]:
+    """
+    加权随机抽样（Vose 别名法）
+        构建 O(n)，每次抽样 O(1)。权重变化时需要重新构建。
+    """
+
+    def __init__(self, items: Sequence[T], weights: Sequence[float]) -> None:
+        n = len(items)
+        total = sum(weights)
+        if n == 0 or n != len(weights) or total <= 0:
+            raise ValueError("items and weights must be non-empty, of equal length, with a positive total weight")
+        self.items = list(items)
+        self.prob = [1.0] * n
+        """第 i 格保留自身的概率"""
+        self.alias = list(range(n))
+        """第 i 格的别名"""
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩余的格子只受浮点误差影响，概率视为 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def sample(self, rng: random.Random | None = None) -> T:
+        """抽取一个元素，默认使用 random 模块的全局随机数生成器"""
+        source = random if rng is None else rng
+        i = source.randrange(len(self.items))
+        return self.items[i] if source.random() < self.prob[i] else self.items[self.alias[i]]
+
+
+def ohlc(history: Sequence[tuple[float, float]], length: int) -> list[tuple[float, float, float, float, float]]:
+    """
+    股价记录降采样
+        history: [(时间戳, 股价)]
+        length: 每组记录数
+        return: [(时间戳, 开, 高, 低, 收)]
+    """
+    result = []
+    for i in range(0, len(history), length):
+        chunk = history[i : i + length]
+        prices = [price for _, price in chunk]
+        result.append((chunk[0][0], prices[0], max(prices), min(prices), prices[-1]))
+    return result
+
+
+class OHLCBars:
+    """
+    增量维护的K线
+        每 length 条股价记录合成一根K线，最多保留 maxlen 根
+    """
+
+    def __init__(self, length: int, maxlen: int) -> None:
+        self.length = length
+        self.bars: deque[tuple[float, float, float, float, float]] = deque(maxlen=maxlen)
+        """已完成的K线 [(时间戳, 开, 高, 低, 收)]"""
+        self.current: list[float] = []
+        """未完成的K线 [时间戳, 开, 高, 低, 收]"""
+        self.count = 0
+        self.last_tick = 0.0
+        """最后一条记录的时间戳"""
+
+    def update(self, t: float, price: float):
+        if self.count == 0:
+            self.current = [t, price, price, price, price]
+        else:
+            current = self.current
+            current[2] = max(current[2], price)
+            current[3] = min(current[3], price)
+            current[4] = price
+        self.count += 1
+        self.last_tick = t
+        if self.count == self.length:
+            self.bars.append(tuple(self.current))  # type: ignore
+            self.count = 0
+
+    def extend(self, history: Iterable[tuple[float, float]]):
+        for t, price in history:
+            self.update(t, price)
+
+    def data(self):
+        """全部K线，包含未完成的一根"""
+        if self.count == 0:
+            return list(self.bars)
+        return [*self.bars, tuple(self.current)]
+
+
 def to_int(N) -> int | None:
     try:
         return int(N)
@@ -179,3 +351,115 @@ async def download_url(url: str, client: httpx.AsyncClient, retry: int = 3):
             await asyncio.sleep(3)
         except httpx.ConnectError:
             return
+
+
+class AvatarEntry:
+    """头像缓存条目"""
+
+    def __init__(self, content: bytes, etag: str | None = None, last_modified: str | None = None, checked: float = 0.0) -> None:
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked = checked
+        """上次向服务器确认的时间戳"""
+
+
+class AvatarCache:
+    """
+    头像缓存
+        内存 LRU + 磁盘内容存储。超过 ttl 的缓存用 ETag / Last-Modified 重新验证，
+        下载失败的地址在 negative_ttl 内不再请求，有旧内容时继续使用旧内容。
+        同一地址的并发请求合并为一次下载。
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        client: httpx.AsyncClient,
+        maxsize: int = 512,
+        ttl: float = 3600,
+        negative_ttl: float = 300,
+        timeout: float = 5,
+    ) -> None:
+        self.path = path
+        self.path.mkdir(exist_ok=True, parents=True)
+        self.client = client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.memory = LRUCache[str, AvatarEntry](maxsize)
+        self.failed = LRUCache[str, float](maxsize)
+        """下载失败的地址 -> 失败时间戳"""
+        self.pending: dict[str, asyncio.Future[bytes | None]] = {}
+
+    def file(self, url: str):
+        return self.path / hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def read(self, url: str):
+        """从磁盘读取缓存，在线程中调用"""
+        file = self.file(url)
+        try:
+            content = file.read_bytes()
+            meta = json.loads(file.with_suffix(".json").read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        return AvatarEntry(content, meta.get("etag"), meta.get("last_modified"), meta.get("checked", 0.0))
+
+    def write(self, url: str, entry: AvatarEntry, content: bool = True):
+        """写入磁盘缓存，在线程中调用"""
+        file = self.file(url)
+        if content:
+            file.write_bytes(entry.content)
+        meta = {"url": url, "etag": entry.etag, "last_modified": entry.last_modified, "checked": entry.checked}
+        file.with_suffix(".json").write_text(json.dumps(meta))
+
+    async def load(self, url: str):
+        """从内存或磁盘读取缓存"""
+        if (entry := self.memory.get(url)) is not None:
+            return entry
+        if (entry := await asyncio.to_thread(self.read, url)) is not None:
+            self.memory.set(url, entry)
+        return entry
+
+    async def save(self, url: str, entry: AvatarEntry, content: bool = True):
+        self.memory.set(url, entry)
+        await asyncio.to_thread(self.write, url, entry, content)
+
+    async def get(self, url: str | None) -> bytes | None:
+        """获取头像，失败时返回旧内容或 None"""
+        if not url:
+            return None
+        entry = await self.load(url)
+        now = time.time()
+        if entry is not None and now - entry.checked < self.ttl:
+            return entry.content
+        if (failed := self.failed.get(url)) is not None and now - failed < self.negative_ttl:
+            return None if entry is None else entry.content
+        if (future := self.pending.get(url)) is None:
+            future = self.pending[url] = asyncio.ensure_future(self.fetch(url, entry))
+            future.add_done_callback(lambda _: self.pending.pop(url, None))
+        return await asyncio.shield(future)
+
+    async def fetch(self, url: str, entry: AvatarEntry | None):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        try:
+            resp = await self.client.get(url, headers=headers, timeout=self.timeout, follow_redirects=True)
+        except httpx.HTTPError:
+            resp = None
+        now = time.time()
+        if resp is not None and resp.status_code == 304 and entry is not None:
+            entry.checked = now
+            await self.save(url, entry, content=False)
+            return entry.content
+        if resp is None or not resp.is_success:
+            self.failed.set(url, now)
+            return None if entry is None else entry.content
+        self.failed.pop(url)
+        entry = AvatarEntry(resp.content, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), now)
+        await self.save(url, entry)
+        return entry.content
@@ -0,0 +1,99 @@
+"""
+数据库配置基准测试
+
+在模拟 stock_update / new_day 的调度线程持续写入的同时，测量处理器（DataBase.run）的读写吞吐与延迟。
+
+    python tools/db_bench.py [秒数]
+"""
+
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+from clovers_sarof.core._config import Config
+from clovers_sarof.core.account import DataBase, Session, User, Group, Account, AccountBank
+
+USERS = 200
+GROUPS = 10
+ITEMS = 20
+
+
+def seed(db: DataBase):
+    with db.session as session:
+        groups = [Group(id=f"g{i}", name="") for i in range(GROUPS)]
+        session.add_all(groups)
+        for i in range(USERS):
+            user = User(id=f"u{i}", name="")
+            session.add(user)
+            for group in groups:
+                session.add(Account(name="", user_id=user.id, group_id=group.id))
+        session.flush()
+        for account in session.exec(Account.select()).all():
+            for item_id in range(ITEMS):
+                session.add(AccountBank(bound_id=account.id, item_id=f"item:{item_id}", n=100))
+
+
+def scheduler_job(db: DataBase, stop: threading.Event, counter: list[int]):
+    """模拟调度线程：整表扫描并批量改写库存"""
+    while not stop.is_set():
+        with db.session as session:
+            for bank in session.exec(AccountBank.select()).all():
+                bank.n += 1
+            session.commit()
+        counter[0] += 1
+        time.sleep(0.05)
+
+
+def read(session: Session, account_id: int):
+    return session.exec(AccountBank.select().where(AccountBank.bound_id == account_id)).all()
+
+
+def write(session: Session, account_id: int):
+    bank = session.bank(AccountBank, account_id, f"item:{random.randrange(ITEMS)}")
+    bank.n += 1
+    session.add(bank)
+
+
+async def handlers(db: DataBase, duration: float):
+    latency: list[float] = []
+    accounts = USERS * GROUPS
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        func = read if random.random() < 0.8 else write
+        start = time.perf_counter()
+        await db.run(func, random.randint(1, accounts))
+        latency.append(time.perf_counter() - start)
+    return latency
+
+
+def bench(name: str, pragmas: dict[str, str | int] | None, pool_size: int, duration: float):
+    with tempfile.TemporaryDirectory() as folder:
+        db = DataBase(f"sqlite:///{(Path(folder) / "bench.db").as_posix()}", pragmas, pool_size)
+        seed(db)
+        stop = threading.Event()
+        counter = [0]
+        thread = threading.Thread(target=scheduler_job, args=(db, stop, counter))
+        thread.start()
+        try:
+            latency = asyncio.run(handlers(db, duration))
+        finally:
+            stop.set()
+            thread.join()
+            db.close()
+    latency.sort()
+    p50 = latency[len(latency) // 2] * 1000
+    p99 = latency[int(len(latency) * 0.99)] * 1000
+    print(
+        f"{name:<8} 处理器 {len(latency) / duration:8.1f} ops/s  "
+        f"p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  调度任务 {counter[0] / duration:5.1f} 次/s"
+    )
+
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    config = Config()
+    bench("默认", None, config.sqlite_pool_size, duration)
+    bench("调优", config.sqlite_pragmas, config.sqlite_pool_size, duration)